@@ -1,42 +1,126 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import akshare as ak
-import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from gupiao.ds.stock_data_source import StockDataSource, circuit_guard, retry_transient
+
+
+class _SessionRequests:
+    """
+    替换 akshare 模块里的 requests：get/post 走共享 Session 复用连接，其余属性透传给 requests。
+    akshare 未指定超时（timeout=None）的请求统一补上默认超时，避免上游挂起时无限等待
+    """
+
+    def __init__(self, session: requests.Session, timeout: float):
+        self._session = session
+        self._timeout = timeout
+
+    def get(self, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self._timeout
+        return self._session.get(*args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self._timeout
+        return self._session.post(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
 
-from gupiao.ds.StockDataSource import StockDataSource
+REQUEST_TIMEOUT = (5, 20)  # (连接超时, 读取超时) 秒
+_session_lock = threading.Lock()
+_session_installed = False
+
+
+def _install_shared_session():
+    """让用到的 akshare 接口共用一个带连接池的 Session，避免每次请求重新 TCP+TLS 握手（进程内只执行一次）"""
+    global _session_installed
+    with _session_lock:
+        if _session_installed:
+            return
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        proxy = _SessionRequests(session, REQUEST_TIMEOUT)
+        for func in (ak.stock_info_a_code_name, ak.stock_zh_a_hist, ak.stock_zh_a_spot_em):
+            if func.__globals__.get("requests") is requests:
+                func.__globals__["requests"] = proxy
+        _session_installed = True
 
 
 class AkShareDataSource(StockDataSource):
+    BATCH_WORKERS = 16  # 批量拉取日线的并发线程数
+    HIST_CONCURRENCY = 8  # 历史行情接口同时在途请求上限
+    SPOT_CONCURRENCY = 2  # 全表类接口（股票列表/实时行情）同时在途请求上限
+    SPOT_TTL = 5  # 实时行情全表的复用时间（秒）
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _install_shared_session()
+        # 舱壁隔离：按接口分组限制并发，超出的请求排队等待，避免触发限流
+        self._hist_sem = threading.BoundedSemaphore(self.HIST_CONCURRENCY)
+        self._spot_sem = threading.BoundedSemaphore(self.SPOT_CONCURRENCY)
+        self._spot_cache = None  # (获取时间, 全市场实时行情DataFrame, 代码->行号)
+        self._spot_lock = threading.Lock()
+
+    @circuit_guard
+    @retry_transient
     def get_stock_list(self):
-        if not self.is_available():
-            print("[SKIP] AkShare 冷却中，跳过请求")
-            return pd.DataFrame()
-
-        try:
-            df = ak.stock_info_a_code_name()
-            self.record_success()
-            return df
-        except Exception as e:
-            self.record_failure(str(e))   # 失败时记录
-            # 这里可以加额外逻辑，比如：检测是否 429 限流错误
-            return pd.DataFrame()
+        with self._spot_sem:
+            return ak.stock_info_a_code_name()
 
+    @circuit_guard
+    @retry_transient
     def get_daily(self, code, start_date, end_date=None, adjust="qfq"):
-        if not self.is_available():
-            return pd.DataFrame()
-        try:
-            df = ak.stock_zh_a_hist(symbol=code, start_date=start_date, end_date=end_date, adjust=adjust)
-            self.record_success()
-            return df
-        except Exception as e:
-            self.record_failure(str(e))
-            return pd.DataFrame()
+        with self._hist_sem:
+            return ak.stock_zh_a_hist(symbol=code, start_date=start_date, end_date=end_date, adjust=adjust)
 
+    def get_daily_batch(self, codes, start_date, end_date=None, adjust="qfq"):
+        """并发拉取多只股票日线（I/O 密集），返回 {code: DataFrame}"""
+        codes = list(codes)
+        if not codes:
+            return {}
+        workers = min(self.BATCH_WORKERS, len(codes))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            dfs = ex.map(lambda c: self.get_daily(c, start_date, end_date, adjust), codes)
+            return dict(zip(codes, dfs))
+
+    def _get_spot(self):
+        """
+        获取全市场实时行情及 代码->行号 索引，SPOT_TTL 内复用同一份数据，并发调用只触发一次请求
+        """
+        # 读路径不加锁：_spot_cache 整体替换为新元组，读到的总是一致的快照
+        cached = self._spot_cache
+        if cached is not None and time.monotonic() - cached[0] < self.SPOT_TTL:
+            return cached[1], cached[2]
+        with self._spot_lock:
+            cached = self._spot_cache
+            if cached is not None and time.monotonic() - cached[0] < self.SPOT_TTL:
+                return cached[1], cached[2]
+            with self._spot_sem:
+                df = ak.stock_zh_a_spot_em()
+            index = {code: i for i, code in enumerate(df["代码"])}
+            self._spot_cache = (time.monotonic(), df, index)
+            return df, index
+
+    @circuit_guard
+    @retry_transient
     def get_today(self, code):
-        if not self.is_available():
-            return pd.DataFrame()
-        try:
-            df = ak.stock_zh_a_spot_em()
-            self.record_success()
-            return df[df["代码"] == code]
-        except Exception as e:
-            self.record_failure(str(e))
-            return pd.DataFrame()
\ No newline at end of file
+        df, index = self._get_spot()
+        i = index.get(code)
+        return df.iloc[0:0] if i is None else df.iloc[[i]]
+
+    # ========== 异步接口 ==========
+    async def aget_stock_list(self):
+        return await asyncio.to_thread(self.get_stock_list)
+
+    async def aget_daily(self, code, start_date, end_date=None, adjust="qfq"):
+        return await asyncio.to_thread(self.get_daily, code, start_date, end_date, adjust)
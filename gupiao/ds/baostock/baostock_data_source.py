@@ -1,64 +1,115 @@
+import atexit
+import random
+import threading
 import time
+from collections import OrderedDict
 from functools import wraps
 
 import baostock as bs
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 from gupiao.ds.data_source_interface import DataSourceInterface
 
 
+# K线结果中已知字段的类型，baostock 统一以字符串返回
+K_DATA_TYPES = {
+    "date": pa.timestamp("ns"),
+    **{field: pa.float64() for field in ("open", "high", "low", "close", "preclose", "volume", "amount",
+                                         "turn", "pctChg", "peTTM", "pbMRQ", "psTTM", "pcfNcfTTM")},
+}
+
+
 # ========== 装饰器 ==========
 # ----------------- 装饰器（模块级） -----------------
 def fail_safe(method):
     """
     装饰器：给实例方法添加失败计数与熔断（cooldown）功能。
     注意：method 是未绑定的函数；wrapper 在运行时以 self 作为第一个参数。
+    实例需在 __init__ 中初始化 _fail_count 与 _cooldown_until 两个字典、半开探测集合 _probing，以及保护它们的 _fail_lock；
+    类需定义 FAIL_THRESHOLD、COOLDOWN、MAX_COOLDOWN、COOLDOWN_JITTER。
+    冷却截止时间使用 time.monotonic()，不受系统时间调整影响。
+    冷却结束后进入半开状态：只放行一个探测请求，成功则恢复，失败则以加倍的冷却时间重新熔断。
     """
+    method_name = method.__name__
 
     @wraps(method)
     def wrapper(self, *args, **kwargs):
-        method_name = method.__name__
-
-        # 确保实例有存储结构
-        if not hasattr(self, "_fail_count"):
-            self._fail_count = {}
-        if not hasattr(self, "_cooldown_until"):
-            self._cooldown_until = {}
-
         # 如果当前方法在冷却期，直接抛错（调用方可捕获并切换数据源）
-        cooldown_until = self._cooldown_until.get(method_name, 0)
-        now = time.time()
-        if now < cooldown_until:
-            raise RuntimeError(
-                f"[COOLDOWN] {self.__class__.__name__}.{method_name} 在冷却中，直到 {time.ctime(cooldown_until)}")
+        cooldown_until = self._cooldown_until.get(method_name, 0.0)
+        probing = False
+        if cooldown_until:
+            if time.monotonic() < cooldown_until:
+                raise RuntimeError(
+                    f"[COOLDOWN] {self.__class__.__name__}.{method_name} 在冷却中，"
+                    f"剩余 {cooldown_until - time.monotonic():.0f}s")
+            with self._fail_lock:
+                if method_name in self._probing:
+                    raise RuntimeError(
+                        f"[COOLDOWN] {self.__class__.__name__}.{method_name} 在冷却中，等待半开探测结果")
+                self._probing.add(method_name)
+            probing = True
 
         try:
             # 执行真实方法
             result = method(self, *args, **kwargs)
-            # 如果执行成功：重置失败计数与冷却（视为恢复）
-            self._fail_count[method_name] = 0
-            # 可选: 清除冷却（若有的话）
-            if method_name in self._cooldown_until:
-                self._cooldown_until.pop(method_name, None)
-            return result
-
         except Exception as e:
-            # 增加失败计数
-            cnt = self._fail_count.get(method_name, 0) + 1
-            self._fail_count[method_name] = cnt
-
-            # 获取阈值和冷却时间（实例可自定义属性）
-            fail_threshold = getattr(self, "FAIL_THRESHOLD", 3)
-            cooldown = getattr(self, "COOLDOWN", 60)
-
-            if cnt >= fail_threshold:
-                self._cooldown_until[method_name] = time.time() + cooldown
+            # 增加失败计数（可能被多个线程同时调用，计数需加锁）
+            with self._fail_lock:
+                cnt = self._fail_count.get(method_name, 0) + 1
+                self._fail_count[method_name] = cnt
+
+            if cnt >= self.FAIL_THRESHOLD:
+                # 连续失败越多冷却越长（指数退避，有上限），加随机抖动避免多个调用方同时恢复
+                cooldown = min(self.COOLDOWN * 2 ** (cnt - self.FAIL_THRESHOLD), self.MAX_COOLDOWN)
+                cooldown += random.uniform(0, self.COOLDOWN_JITTER)
+                self._cooldown_until[method_name] = time.monotonic() + cooldown
                 # 打印/记录信息
                 print(
-                    f"[COOLDOWN] {self.__class__.__name__}.{method_name} 连续失败 {cnt} 次，触发冷却 {cooldown}s。最后异常: {e!r}")
+                    f"[COOLDOWN] {self.__class__.__name__}.{method_name} 连续失败 {cnt} 次，触发冷却 {cooldown:.0f}s。最后异常: {e!r}")
 
             # 继续抛出异常，外部工厂可以捕获并切换数据源
             raise
+        else:
+            # 如果执行成功：重置失败计数与冷却（视为恢复）；从未失败时不做任何写入
+            if self._fail_count.get(method_name):
+                self._fail_count[method_name] = 0
+            if cooldown_until:
+                self._cooldown_until.pop(method_name, None)
+            return result
+        finally:
+            if probing:
+                self._probing.discard(method_name)
+
+    return wrapper
+
+
+def query_cache(method):
+    """
+    装饰器：缓存幂等查询（股票列表、交易日、指数成分等）的结果，返回副本。
+    缓存键包含当天日期，date=None（当天）的结果跨日自动失效；条目另有 QUERY_CACHE_TTL 过期时间。
+    放在 fail_safe 内层，失败不缓存且仍计入失败次数。
+    实例需在 __init__ 中初始化 _query_cache（OrderedDict）与 _query_cache_lock。
+    """
+    method_name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method_name, time.strftime("%Y-%m-%d"), args, tuple(sorted(kwargs.items())))
+        with self._query_cache_lock:
+            item = self._query_cache.get(key)
+            if item is not None and time.monotonic() - item[0] < self.QUERY_CACHE_TTL:
+                self._query_cache.move_to_end(key)
+                return item[1].copy()
+
+        df = method(self, *args, **kwargs)
+        with self._query_cache_lock:
+            self._query_cache[key] = (time.monotonic(), df)
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self.QUERY_CACHE_ENTRIES:
+                self._query_cache.popitem(last=False)
+        return df.copy()
 
     return wrapper
 
@@ -67,36 +118,65 @@ def fail_safe(method):
 class BaoStockDataSource(DataSourceInterface):
     """Baostock 数据源实现"""
     FAIL_THRESHOLD = 3  # 连续失败阈值（可按实例/类覆盖）
-    COOLDOWN = 60  # 熔断冷却时间（秒）
+    COOLDOWN = 60  # 熔断冷却时间（秒），连续失败超过阈值后按2的幂递增
+    MAX_COOLDOWN = 600  # 熔断冷却时间上限（秒）
+    COOLDOWN_JITTER = 5  # 冷却时间随机抖动上限（秒）
+    MAX_CONCURRENCY = 1  # baostock 所有请求共用一个全局socket，并发请求会串包
+    K_DATA_TYPES = K_DATA_TYPES  # K线结果的列类型，分区缓存读取结果按此对齐
+    QUERY_CACHE_TTL = 3600  # 幂等查询结果的缓存时间（秒）
+    QUERY_CACHE_ENTRIES = 64  # 幂等查询结果的缓存条目数
+
+    # baostock 的登录状态是进程全局的，所有实例共用一个会话
+    _session = None
+    _session_lock = threading.Lock()
 
     def __init__(self):
         """
-        初始化BaoStock数据源，登录到BaoStock服务
+        初始化BaoStock数据源，首次创建时登录到BaoStock服务，之后的实例复用同一会话
         如果登录失败，会抛出异常
         """
         self._fail_count = {}
         self._cooldown_until = {}
-        self.session = bs.login()
-        if self.session.error_code != '0':
-            raise Exception(f"baostock 登录失败: {self.session.error_msg}")
-
-    def __del__(self):
-        """
-        析构函数，登出BaoStock服务
-        """
-        try:
-            bs.logout()
-        except Exception:
-            pass
+        self._probing = set()
+        self._fail_lock = threading.Lock()
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.session = self._login()
+
+    @classmethod
+    def _login(cls):
+        """登录BaoStock服务（进程内只登录一次）"""
+        with cls._session_lock:
+            if cls._session is None:
+                session = bs.login()
+                if session.error_code != '0':
+                    raise Exception(f"baostock 登录失败: {session.error_msg}")
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def close(cls):
+        """
+        登出BaoStock服务，进程退出时自动调用
+        """
+        with cls._session_lock:
+            if cls._session is None:
+                return
+            cls._session = None
+            try:
+                bs.logout()
+            except Exception:
+                pass
 
     # ========== 内部工具 ==========
     @staticmethod
-    def _to_df(rs):
+    def _to_df(rs, types=None):
         """
         将BaoStock返回的结果集转换为pandas DataFrame
 
         Args:
             rs: BaoStock查询返回的结果集
+            types (dict, optional): 字段名到Arrow类型的映射，给出时按该类型解析对应列（空串视为缺失值）
 
         Returns:
             pd.DataFrame: 包含查询结果的DataFrame
@@ -106,13 +186,30 @@ class BaoStockDataSource(DataSourceInterface):
         """
         if rs.error_code != "0":
             raise Exception(f"baostock error: {rs.error_code}, {rs.error_msg}")
-        data_list = []
-        while rs.next():
-            data_list.append(rs.get_row_data())
-        return pd.DataFrame(data_list, columns=rs.fields)
+        rows = []
+        append, next_row, get_row = rows.append, rs.next, rs.get_row_data
+        while next_row():
+            append(get_row())
+
+        if not types:
+            if not rows:
+                return pd.DataFrame(columns=rs.fields)
+            # 行转列后按列构建，避免pandas逐行推断类型
+            return pd.DataFrame(dict(zip(rs.fields, zip(*rows))))
+
+        # 已知类型的字段由Arrow一次性解析字符串，不再经过pandas的object列二次转换
+        columns = zip(*rows) if rows else ((),) * len(rs.fields)
+        arrays = {}
+        for field, values in zip(rs.fields, columns):
+            arr = pa.array(values, type=pa.string())
+            if field in types:
+                arr = pc.if_else(pc.equal(arr, ""), pa.scalar(None, pa.string()), arr).cast(types[field])
+            arrays[field] = arr
+        return pa.table(arrays).to_pandas()
 
     # ========== 实现接口 ==========
     @fail_safe
+    @query_cache
     def query_all_stock(self, date=None):
         """
         查询指定日期的所有股票信息
@@ -139,6 +236,21 @@ class BaoStockDataSource(DataSourceInterface):
         return self._to_df(bs.query_stock_basic(code=code))
 
     @fail_safe
+    def query_stock_basic_many(self, codes: list):
+        """
+        批量查询股票基本信息，一次请求取回全部证券后在本地按代码过滤
+
+        Args:
+            codes (list): 股票代码列表，例如：["sh.600000", "sz.000001"]
+
+        Returns:
+            pd.DataFrame: 包含所给股票基本信息的DataFrame
+        """
+        df = self._to_df(bs.query_stock_basic())
+        return df[df['code'].isin(codes)].reset_index(drop=True)
+
+    @fail_safe
+    @query_cache
     def query_trade_dates(self, start_date: str, end_date: str):
         """
         查询指定日期范围内的交易日信息
@@ -179,9 +291,10 @@ class BaoStockDataSource(DataSourceInterface):
         """
         return self._to_df(bs.query_history_k_data_plus(
             code, fields, start_date, end_date, frequency, adjustflag
-        ))
+        ), K_DATA_TYPES)
 
     @fail_safe
+    @query_cache
     def query_stock_industry(self, date=None):
         """
         查询股票行业分类
@@ -195,6 +308,7 @@ class BaoStockDataSource(DataSourceInterface):
         return self._to_df(bs.query_stock_industry(date=date))
 
     @fail_safe
+    @query_cache
     def query_sz50_stocks(self, date=None):
         """
         查询上证50成分股
@@ -208,6 +322,7 @@ class BaoStockDataSource(DataSourceInterface):
         return self._to_df(bs.query_sz50_stocks(date=date))
 
     @fail_safe
+    @query_cache
     def query_hs300_stocks(self, date=None):
         """
         查询沪深300成分股
@@ -221,6 +336,7 @@ class BaoStockDataSource(DataSourceInterface):
         return self._to_df(bs.query_hs300_stocks(date=date))
 
     @fail_safe
+    @query_cache
     def query_zz500_stocks(self, date=None):
         """
         查询中证500成分股
@@ -346,6 +462,9 @@ class BaoStockDataSource(DataSourceInterface):
         return self._to_df(bs.query_cash_flow_data(code=code, year=year, quarter=quarter))
 
 
+atexit.register(BaoStockDataSource.close)
+
+
 if __name__ == "__main__":
     ds = BaoStockDataSource()
 
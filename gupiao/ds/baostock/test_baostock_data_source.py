@@ -3,22 +3,28 @@ from unittest.mock import patch, MagicMock
 import pandas as pd
 import time
 
-from gupiao.ds.baostock.BaostockDataSource import BaoStockDataSource
+from gupiao.ds.baostock.baostock_data_source import BaoStockDataSource, K_DATA_TYPES
 
 
 class TestBaoStockDataSource(unittest.TestCase):
 
     def setUp(self):
         """测试前准备"""
-        with patch('ds.baostock.BaostockDataSource.bs.login') as mock_login:
+        BaoStockDataSource._session = None
+        with patch('gupiao.ds.baostock.baostock_data_source.bs.login') as mock_login:
             mock_session = MagicMock()
             mock_session.error_code = '0'
             mock_login.return_value = mock_session
             self.datasource = BaoStockDataSource()
 
+    def tearDown(self):
+        """测试后清理共享会话"""
+        BaoStockDataSource._session = None
+
     def test_init_success(self):
         """测试初始化成功"""
-        with patch('ds.baostock.BaostockDataSource.bs.login') as mock_login:
+        BaoStockDataSource._session = None
+        with patch('gupiao.ds.baostock.baostock_data_source.bs.login') as mock_login:
             mock_session = MagicMock()
             mock_session.error_code = '0'
             mock_login.return_value = mock_session
@@ -27,9 +33,27 @@ class TestBaoStockDataSource(unittest.TestCase):
             self.assertIsNotNone(datasource)
             mock_login.assert_called_once()
 
+    def test_init_reuses_session(self):
+        """测试多个实例复用同一登录会话"""
+        with patch('gupiao.ds.baostock.baostock_data_source.bs.login') as mock_login:
+            datasource = BaoStockDataSource()
+
+            mock_login.assert_not_called()
+            self.assertIs(datasource.session, self.datasource.session)
+
+    @patch('gupiao.ds.baostock.baostock_data_source.bs.logout')
+    def test_close(self, mock_logout):
+        """测试close登出并清除共享会话，重复调用只登出一次"""
+        BaoStockDataSource.close()
+        BaoStockDataSource.close()
+
+        mock_logout.assert_called_once()
+        self.assertIsNone(BaoStockDataSource._session)
+
     def test_init_failure(self):
         """测试初始化失败"""
-        with patch('ds.baostock.BaostockDataSource.bs.login') as mock_login:
+        BaoStockDataSource._session = None
+        with patch('gupiao.ds.baostock.baostock_data_source.bs.login') as mock_login:
             mock_session = MagicMock()
             mock_session.error_code = '1'
             mock_session.error_msg = '登录失败'
@@ -54,6 +78,52 @@ class TestBaoStockDataSource(unittest.TestCase):
         self.assertEqual(len(df), 2)
         self.assertEqual(list(df.columns), ['col1', 'col2'])
 
+    def test_to_df_empty(self):
+        """测试_to_df在无数据时保留列名"""
+        mock_rs = MagicMock()
+        mock_rs.error_code = '0'
+        mock_rs.fields = ['col1', 'col2']
+        mock_rs.next.return_value = False
+
+        df = BaoStockDataSource._to_df(mock_rs)
+
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), ['col1', 'col2'])
+
+    @patch('gupiao.ds.baostock.baostock_data_source.bs.query_history_k_data_plus')
+    def test_query_history_k_data_plus_types(self, mock_query):
+        """测试K线结果的日期与数值字段被转换类型"""
+        mock_rs = MagicMock()
+        mock_rs.error_code = '0'
+        mock_rs.fields = ['date', 'code', 'close', 'volume']
+        mock_rs.next.side_effect = [True, True, False]
+        mock_rs.get_row_data.side_effect = [['2025-09-15', 'sh.600000', '10.20', '1000'],
+                                            ['2025-09-16', 'sh.600000', '', '1200']]
+        mock_query.return_value = mock_rs
+
+        df = self.datasource.query_history_k_data_plus('sh.600000', 'date,code,close,volume',
+                                                       '2025-09-15', '2025-09-16')
+
+        self.assertEqual(df['date'].iloc[0], pd.Timestamp('2025-09-15'))
+        self.assertEqual(df['close'].iloc[0], 10.2)
+        self.assertTrue(pd.isna(df['close'].iloc[1]))
+        self.assertEqual(df['volume'].tolist(), [1000, 1200])
+        self.assertEqual(df['code'].tolist(), ['sh.600000', 'sh.600000'])
+
+    def test_to_df_typed_empty(self):
+        """测试按已知类型转换时空结果也保留列类型"""
+        mock_rs = MagicMock()
+        mock_rs.error_code = '0'
+        mock_rs.fields = ['date', 'code', 'close']
+        mock_rs.next.return_value = False
+
+        df = BaoStockDataSource._to_df(mock_rs, K_DATA_TYPES)
+
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), ['date', 'code', 'close'])
+        self.assertEqual(df['close'].dtype, 'float64')
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['date']))
+
     def test_to_df_error(self):
         """测试_to_df方法处理错误"""
         mock_rs = MagicMock()
@@ -65,7 +135,7 @@ class TestBaoStockDataSource(unittest.TestCase):
 
         self.assertIn('baostock error', str(context.exception))
 
-    @patch('ds.baostock.BaostockDataSource.bs.query_all_stock')
+    @patch('gupiao.ds.baostock.baostock_data_source.bs.query_all_stock')
     def test_query_all_stock(self, mock_query):
         """测试query_all_stock方法"""
         # 模拟返回结果
@@ -81,7 +151,24 @@ class TestBaoStockDataSource(unittest.TestCase):
         self.assertIsInstance(df, pd.DataFrame)
         mock_query.assert_called_once_with(day='2025-09-16')
 
-    @patch('ds.baostock.BaostockDataSource.bs.query_stock_basic')
+    @patch('gupiao.ds.baostock.baostock_data_source.bs.query_all_stock')
+    def test_query_all_stock_cached(self, mock_query):
+        """测试相同参数的query_all_stock只请求一次，且返回副本"""
+        mock_rs = MagicMock()
+        mock_rs.error_code = '0'
+        mock_rs.fields = ['code', 'code_name']
+        mock_rs.next.side_effect = [True, False]
+        mock_rs.get_row_data.return_value = ['sh.600000', '浦发银行']
+        mock_query.return_value = mock_rs
+
+        first = self.datasource.query_all_stock('2025-09-16')
+        first.loc[0, 'code_name'] = 'changed'
+        second = self.datasource.query_all_stock('2025-09-16')
+
+        mock_query.assert_called_once_with(day='2025-09-16')
+        self.assertEqual(second.loc[0, 'code_name'], '浦发银行')
+
+    @patch('gupiao.ds.baostock.baostock_data_source.bs.query_stock_basic')
     def test_query_stock_basic(self, mock_query):
         """测试query_stock_basic方法"""
         mock_rs = MagicMock()
@@ -96,7 +183,23 @@ class TestBaoStockDataSource(unittest.TestCase):
         self.assertIsInstance(df, pd.DataFrame)
         mock_query.assert_called_once_with(code='sh.600000')
 
-    @patch('ds.baostock.BaostockDataSource.bs.query_trade_dates')
+    @patch('gupiao.ds.baostock.baostock_data_source.bs.query_stock_basic')
+    def test_query_stock_basic_many(self, mock_query):
+        """测试query_stock_basic_many方法只发起一次请求并按代码过滤"""
+        mock_rs = MagicMock()
+        mock_rs.error_code = '0'
+        mock_rs.fields = ['code', 'code_name']
+        mock_rs.next.side_effect = [True, True, True, False]
+        mock_rs.get_row_data.side_effect = [['sh.600000', '浦发银行'], ['sz.000001', '平安银行'],
+                                            ['sz.000002', '万科A']]
+        mock_query.return_value = mock_rs
+
+        df = self.datasource.query_stock_basic_many(['sh.600000', 'sz.000002'])
+
+        self.assertEqual(df['code'].tolist(), ['sh.600000', 'sz.000002'])
+        mock_query.assert_called_once_with()
+
+    @patch('gupiao.ds.baostock.baostock_data_source.bs.query_trade_dates')
     def test_query_trade_dates(self, mock_query):
         """测试query_trade_dates方法"""
         mock_rs = MagicMock()
@@ -113,7 +216,7 @@ class TestBaoStockDataSource(unittest.TestCase):
 
     def test_fail_safe_decorator_success(self):
         """测试fail_safe装饰器成功情况"""
-        with patch('ds.baostock.BaostockDataSource.bs.query_all_stock') as mock_query:
+        with patch('gupiao.ds.baostock.baostock_data_source.bs.query_all_stock') as mock_query:
             mock_rs = MagicMock()
             mock_rs.error_code = '0'
             mock_rs.fields = ['date']
@@ -133,7 +236,7 @@ class TestBaoStockDataSource(unittest.TestCase):
 
     def test_fail_safe_decorator_failure(self):
         """测试fail_safe装饰器失败处理"""
-        with patch('ds.baostock.BaostockDataSource.bs.query_all_stock') as mock_query:
+        with patch('gupiao.ds.baostock.baostock_data_source.bs.query_all_stock') as mock_query:
             mock_query.side_effect = Exception('网络错误')
 
             # 重置计数器
@@ -154,19 +257,53 @@ class TestBaoStockDataSource(unittest.TestCase):
 
             # 检查是否设置了熔断
             self.assertIn('query_all_stock', self.datasource._cooldown_until)
-            self.assertGreater(self.datasource._cooldown_until['query_all_stock'], time.time())
+            cooldown_until = self.datasource._cooldown_until['query_all_stock']
+            self.assertGreater(cooldown_until, time.monotonic() + BaoStockDataSource.COOLDOWN - 1)
+
+            # 冷却结束后再次失败，冷却时间翻倍
+            self.datasource._cooldown_until['query_all_stock'] = time.monotonic() - 1
+            with self.assertRaises(Exception):
+                self.datasource.query_all_stock('2025-09-16')
+            self.assertGreater(self.datasource._cooldown_until['query_all_stock'],
+                               time.monotonic() + 2 * BaoStockDataSource.COOLDOWN - 1)
 
     def test_fail_safe_decorator_cool_down(self):
         """测试fail_safe装饰器熔断机制"""
         # 手动设置熔断
         self.datasource._cooldown_until = {
-            'query_all_stock': time.time() + 10  # 10秒后解封
+            'query_all_stock': time.monotonic() + 10  # 10秒后解封
         }
 
         with self.assertRaises(RuntimeError) as context:
             self.datasource.query_all_stock('2025-09-16')
 
-        self.assertIn('已熔断', str(context.exception))
+        self.assertIn('冷却中', str(context.exception))
+
+    def test_fail_safe_half_open_single_probe(self):
+        """测试冷却结束后只放行一个探测请求，探测成功后恢复"""
+        self.datasource._fail_count = {'query_all_stock': BaoStockDataSource.FAIL_THRESHOLD}
+        self.datasource._cooldown_until = {'query_all_stock': time.monotonic() - 1}
+
+        # 已有探测请求在进行中，其余调用仍被拒绝
+        self.datasource._probing.add('query_all_stock')
+        with self.assertRaises(RuntimeError) as context:
+            self.datasource.query_all_stock('2025-09-16')
+        self.assertIn('冷却中', str(context.exception))
+        self.datasource._probing.clear()
+
+        with patch('gupiao.ds.baostock.baostock_data_source.bs.query_all_stock') as mock_query:
+            mock_rs = MagicMock()
+            mock_rs.error_code = '0'
+            mock_rs.fields = ['code']
+            mock_rs.next.side_effect = [True, False]
+            mock_rs.get_row_data.return_value = ['sh.600000']
+            mock_query.return_value = mock_rs
+
+            self.datasource.query_all_stock('2025-09-16')
+
+        self.assertNotIn('query_all_stock', self.datasource._cooldown_until)
+        self.assertEqual(self.datasource._fail_count['query_all_stock'], 0)
+        self.assertEqual(self.datasource._probing, set())
 
 
 if __name__ == '__main__':
@@ -5,6 +5,9 @@ import pandas as pd
 class DataSourceInterface(ABC):
     """数据源接口，定义统一方法"""
 
+    MAX_CONCURRENCY = 8  # 允许同时发起的请求数；客户端非线程安全的数据源应覆盖为1
+    K_DATA_TYPES = {}  # query_history_k_data_plus 返回列的Arrow类型（列名 -> pa.DataType），空表示不做约定
+
     # ========== 股票列表 ==========
     @abstractmethod
     def query_all_stock(self, date=None) -> pd.DataFrame:
@@ -14,6 +17,10 @@ class DataSourceInterface(ABC):
     def query_stock_basic(self, code: str) -> pd.DataFrame:
         pass
 
+    @abstractmethod
+    def query_stock_basic_many(self, codes: list) -> pd.DataFrame:
+        pass
+
     # ========== 交易日 ==========
     @abstractmethod
     def query_trade_dates(self, start_date: str, end_date: str) -> pd.DataFrame:
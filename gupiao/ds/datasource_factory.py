@@ -1,10 +1,32 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
 import pandas as pd
 
 from gupiao.ds.ak.AkShareDataSource import AkShareDataSource
+from gupiao.ds.parquet.parquet_cache import ParquetCache
+from gupiao.ds.stock_data_source import InvalidRequestError
 # from ds.baostock.BaostockDataSource import BaostockDataSource
 
+_DATE_RE = re.compile(r"\d{8}")  # akshare 日期格式 YYYYMMDD
+
+
+def _check_dates(start_date, end_date):
+    """在发起网络请求前校验日期格式，格式错误直接抛 InvalidRequestError"""
+    if not _DATE_RE.fullmatch(start_date) or (end_date is not None and not _DATE_RE.fullmatch(end_date)):
+        raise InvalidRequestError(f"日期格式应为 YYYYMMDD: start_date={start_date!r}, end_date={end_date!r}")
+
 
 class DataSourceFactory:
+    MEM_MAXSIZE = 4096  # 进程内缓存最大条目数
+    MEM_TTL = 60  # 进程内缓存默认有效期（秒）
+    # 按 key 前缀区分的进程内缓存有效期：股票列表一天内基本不变，历史日线变化也很少
+    MEM_TTL_BY_PREFIX = {"stock_list": 24 * 3600, "daily_": 3600, "today_": 60}
+
     def __init__(self, cache=None):
         sources = [
             # (BaostockDataSource(), 1),
@@ -13,25 +35,94 @@ class DataSourceFactory:
             # (TencentDataSource(), 2),
             # (SinaDataSource(), 3),
         ]
-        self.sources = sorted(sources, key=lambda x: x[1])  # (实例, 优先级)
+        # (实例, 优先级) 只在初始化时排序一次，运行期只保留按优先级排好的实例
+        self.sources = [src for src, prio in sorted(sources, key=lambda x: x[1])]
         self.cache = cache
+        self._mem = OrderedDict()  # key -> (过期时间, DataFrame)，按LRU顺序排列
+        self._mem_lock = threading.Lock()
+        self._inflight = {}  # key -> Future，相同key的并发请求共享一次拉取
+        self._inflight_lock = threading.Lock()
 
-    def _load_or_fetch(self, key: str, fetch_func):
+    def _mem_get(self, key: str):
+        with self._mem_lock:
+            item = self._mem.get(key)
+            if item is None:
+                return None
+            expires_at, df = item
+            if time.time() >= expires_at:
+                del self._mem[key]
+                return None
+            self._mem.move_to_end(key)
+        # 返回副本，调用方修改结果不影响缓存中的对象
+        return df.copy()
+
+    def _mem_ttl(self, key: str):
+        for prefix, ttl in self.MEM_TTL_BY_PREFIX.items():
+            if key.startswith(prefix):
+                return ttl
+        return self.MEM_TTL
+
+    def _mem_put(self, key: str, df):
+        ttl = self._mem_ttl(key)
+        with self._mem_lock:
+            self._mem[key] = (time.time() + ttl, df)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.MEM_MAXSIZE:
+                self._mem.popitem(last=False)
+
+    def _cache_load(self, key: str):
+        """依次查询内存缓存、磁盘缓存；磁盘命中时回填内存。返回的都是副本"""
+        df = self._mem_get(key)
+        if df is not None:
+            return df
         if self.cache:
             df = self.cache.load(key)
             if df is not None:
                 print(f"[CACHE] {key} 命中缓存")
-                return df
+                self._mem_put(key, df)
+                return df.copy()
+        return None
+
+    def _cache_save(self, key: str, df):
+        self._mem_put(key, df)
+        if self.cache:
+            self.cache.save(key, df)
+
+    def _load_or_fetch(self, key: str, fetch_func):
+        df = self._cache_load(key)
+        if df is not None:
+            return df
+
+        with self._inflight_lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            return fut.result().copy()
 
-        for src, prio in self.sources:
+        try:
+            df = self._fetch_from_sources(key, fetch_func)
+            fut.set_result(df)
+            # 拉取结果已写入内存缓存，并发等待者与发起者各自拿副本
+            return df.copy()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _fetch_from_sources(self, key: str, fetch_func):
+        for src in self.sources:
             if not src.is_available():
                 print(f"[SKIP] {src.__class__.__name__} 在冷却期，跳过")
                 continue
 
             df = fetch_func(src)
             if df is not None and not df.empty:
+                self._cache_save(key, df)
                 if self.cache:
-                    self.cache.save(key, df)
                     print(f"[CACHE] {key} 已写入缓存")
                 return df
 
@@ -40,20 +131,73 @@ class DataSourceFactory:
     def get_stock_list(self):
         return self._load_or_fetch("stock_list", lambda src: src.get_stock_list())
 
+    @staticmethod
+    def _daily_key(code, start_date, end_date, adjust):
+        return f"daily_{code}_{start_date}_{end_date}_{adjust}"
+
     def get_daily(self, code, start_date, end_date=None, adjust="qfq"):
-        key = f"daily_{code}_{start_date}_{end_date}_{adjust}"
+        _check_dates(start_date, end_date)
+        key = self._daily_key(code, start_date, end_date, adjust)
         return self._load_or_fetch(key, lambda src: src.get_daily(code, start_date, end_date, adjust))
 
+    def get_daily_batch(self, codes, start_date, end_date=None, adjust="qfq"):
+        """批量获取日线：先逐个查缓存，只把未命中的代码交给数据源批量拉取"""
+        _check_dates(start_date, end_date)
+        codes = list(codes)
+        result = {}
+        misses = []
+        for code in codes:
+            df = self._cache_load(self._daily_key(code, start_date, end_date, adjust))
+            if df is not None:
+                result[code] = df
+            else:
+                misses.append(code)
+
+        for src in self.sources:
+            if not misses:
+                break
+            if not src.is_available():
+                print(f"[SKIP] {src.__class__.__name__} 在冷却期，跳过")
+                continue
+
+            fetched = src.get_daily_batch(misses, start_date, end_date, adjust)
+            remaining = []
+            for code in misses:
+                df = fetched.get(code)
+                if df is not None and not df.empty:
+                    self._cache_save(self._daily_key(code, start_date, end_date, adjust), df)
+                    result[code] = df.copy()
+                else:
+                    remaining.append(code)
+            misses = remaining
+
+        for code in misses:
+            result[code] = pd.DataFrame()
+        return {code: result[code] for code in codes}
+
+    async def get_daily_many(self, codes, start_date, end_date=None, adjust="qfq"):
+        """异步并发获取多只股票日线，总耗时约为最慢一次请求而非逐个累加"""
+        _check_dates(start_date, end_date)
+        codes = list(codes)
+        dfs = await asyncio.gather(*[
+            asyncio.to_thread(self.get_daily, code, start_date, end_date, adjust) for code in codes
+        ])
+        return dict(zip(codes, dfs))
+
     def get_today(self, code):
-        key = f"today_{code}_{pd.Timestamp.today().strftime('%Y%m%d')}"
+        key = f"today_{code}_{time.strftime('%Y%m%d')}"
         return self._load_or_fetch(key, lambda src: src.get_today(code))
 
 
 if __name__ == "__main__":
-    ds = DataSourceFactory()
+    ds = DataSourceFactory(cache=ParquetCache())
     stock_list = ds.get_stock_list()
     print(stock_list)
-    for stock in stock_list.values:
-        print(ds.get_daily(stock[0], "20250103",  "20250107"))
+    codes = stock_list["code"].tolist()
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        futures = {ex.submit(ds.get_daily, code, "20250103", "20250107"): code for code in codes}
+        for i, fut in enumerate(as_completed(futures), 1):
+            print(f"[{i}/{len(codes)}] {futures[fut]}")
+            print(fut.result())
 
     print(ds.get_today("600000"))
@@ -0,0 +1,80 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+
+
+class ParquetCache:
+    """基于Parquet文件的磁盘缓存，可作为 DataSourceFactory 的 cache 使用"""
+
+    def __init__(self, cache_dir: str = "cache/factory", compression: str = "zstd", dedup: bool = False):
+        """
+        初始化Parquet磁盘缓存
+
+        Args:
+            cache_dir: 缓存目录路径
+            compression: Parquet压缩算法，默认zstd（体积小且解压快）
+            dedup: 是否按内容去重，内容相同的key硬链接到同一个文件
+        """
+        self.cache_dir = Path(cache_dir)
+        self.compression = compression
+        self.dedup = dedup
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.objects_dir = self.cache_dir / "objects"
+        if dedup:
+            self.objects_dir.mkdir(exist_ok=True)
+
+    def _path(self, key: str, suffix: str = ".parquet") -> Path:
+        return self.cache_dir / f"{key}{suffix}"
+
+    def load(self, key: str) -> Optional[pd.DataFrame]:
+        """读取缓存，不存在时返回None"""
+        path = self._path(key)
+        if path.exists():
+            return pd.read_parquet(path)
+        path = self._path(key, ".pkl")
+        if path.exists():
+            return pd.read_pickle(path)
+        return None
+
+    def _write(self, stem: Path, df: pd.DataFrame) -> Path:
+        """
+        写入文件并返回实际路径
+
+        优先写zstd压缩的Parquet；含混合类型object列等Arrow无法表示的数据时退回pickle
+        """
+        path = stem.with_suffix(".parquet")
+        try:
+            df.to_parquet(path, compression=self.compression, engine="pyarrow")
+            return path
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            path.unlink(missing_ok=True)
+            path = stem.with_suffix(".pkl")
+            df.to_pickle(path)
+            return path
+
+    @staticmethod
+    def content_hash(df: pd.DataFrame) -> str:
+        """计算DataFrame内容哈希（列名 + 逐行哈希）"""
+        h = hashlib.blake2b("\x1f".join(map(str, df.columns)).encode(), digest_size=16)
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+        return h.hexdigest()
+
+    def save(self, key: str, df: pd.DataFrame):
+        """写入缓存"""
+        if not self.dedup:
+            self._write(self.cache_dir / key, df)
+            return
+
+        digest = self.content_hash(df)
+        blob = next((p for p in (self.objects_dir / f"{digest}.parquet", self.objects_dir / f"{digest}.pkl")
+                     if p.exists()), None)
+        if blob is None:
+            blob = self._write(self.objects_dir / digest, df)
+
+        for suffix in (".parquet", ".pkl"):
+            self._path(key, suffix).unlink(missing_ok=True)
+        os.link(blob, self._path(key, blob.suffix))
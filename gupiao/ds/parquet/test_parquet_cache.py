@@ -0,0 +1,56 @@
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from gupiao.ds.parquet.parquet_cache import ParquetCache
+
+
+class TestParquetCache(unittest.TestCase):
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ParquetCache(cache_dir=self.temp_dir)
+
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_load_missing(self):
+        """测试未命中返回None"""
+        self.assertIsNone(self.cache.load("daily_600000_20250103_20250107_qfq"))
+
+    def test_save_and_load(self):
+        """测试写入后可读回相同数据"""
+        df = pd.DataFrame({"日期": ["2025-01-03", "2025-01-06"], "收盘": [10.1, 10.3]})
+        self.cache.save("daily_600000_20250103_20250107_qfq", df)
+
+        loaded = self.cache.load("daily_600000_20250103_20250107_qfq")
+        pd.testing.assert_frame_equal(loaded, df)
+
+    def test_fallback_to_pickle(self):
+        """测试Arrow无法表示的混合类型列退回pickle存储"""
+        df = pd.DataFrame({"代码": ["600000", 1]})
+        self.cache.save("stock_list", df)
+
+        self.assertFalse((self.cache.cache_dir / "stock_list.parquet").exists())
+        pd.testing.assert_frame_equal(self.cache.load("stock_list"), df)
+
+    def test_dedup_shares_file(self):
+        """测试开启去重后内容相同的key共享同一个文件"""
+        cache = ParquetCache(cache_dir=self.temp_dir, dedup=True)
+        df = pd.DataFrame({"日期": ["2025-01-03"], "收盘": [10.1]})
+        cache.save("daily_600000_20250103_20250103_qfq", df)
+        cache.save("daily_600000_20250103_None_qfq", df.copy())
+
+        self.assertEqual(len(list(cache.objects_dir.iterdir())), 1)
+        a = (cache.cache_dir / "daily_600000_20250103_20250103_qfq.parquet").stat()
+        b = (cache.cache_dir / "daily_600000_20250103_None_qfq.parquet").stat()
+        self.assertEqual(a.st_ino, b.st_ino)
+        pd.testing.assert_frame_equal(cache.load("daily_600000_20250103_None_qfq"), df)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pyarrow as pa
+
+from gupiao.ds.parquet.time_partitioned_data_source import TimePartitionedDataSource
+
+
+def make_k_data(codes, start_date, end_date):
+    """生成模拟的日K线数据（仅工作日）"""
+    dates = pd.bdate_range(start_date, end_date).strftime("%Y-%m-%d")
+    return pd.DataFrame([
+        {"date": d, "code": code, "open": "10.0", "high": "10.5", "low": "9.8", "close": "10.2",
+         "volume": "1000", "amount": "10200", "turn": "0.5"}
+        for code in codes for d in dates
+    ])
+
+
+class TestTimePartitionedDataSource(unittest.TestCase):
+
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.real_source = MagicMock()
+        self.real_source.MAX_CONCURRENCY = 4
+        self.real_source.query_all_stock.return_value = pd.DataFrame({"code": ["sh.600000", "sz.000001"]})
+        self.real_source.query_history_k_data_plus.side_effect = \
+            lambda code, fields, start_date, end_date, *args: make_k_data([code], start_date, end_date)
+        self.ds = TimePartitionedDataSource(self.real_source, cache_dir=self.temp_dir)
+
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_query_partition_data(self):
+        """测试跨月查询会构建分区并按日期与代码过滤"""
+        df = self.ds.query_partition_data("2024-01-15", "2024-02-10", ["sh.600000"])
+
+        self.assertFalse(df.empty)
+        self.assertEqual(set(df["code"]), {"sh.600000"})
+        self.assertEqual(df["date"].min(), pd.Timestamp("2024-01-15"))
+        self.assertEqual(df["date"].max(), pd.Timestamp("2024-02-09"))
+
+    def test_query_partition_data_columns(self):
+        """测试列裁剪只返回请求的列"""
+        df = self.ds.query_partition_data("2024-01-15", "2024-02-10", ["sz.000001"], ["date", "code", "close"])
+
+        self.assertEqual(list(df.columns), ["date", "code", "close"])
+        self.assertEqual(set(df["code"]), {"sz.000001"})
+
+    def test_build_partition_skips_failed_codes(self):
+        """测试并发构建分区时单只股票拉取失败不影响其他股票"""
+        def fetch(code, fields, start_date, end_date, *args):
+            if code == "sz.000001":
+                raise RuntimeError("network error")
+            return make_k_data([code], start_date, end_date)
+        self.real_source.query_history_k_data_plus.side_effect = fetch
+
+        df = self.ds.query_partition_data("2024-01-01", "2024-01-31")
+
+        self.assertEqual(set(df["code"]), {"sh.600000"})
+        self.assertEqual(self.real_source.query_history_k_data_plus.call_count, 2)
+
+    def test_failed_build_is_not_memoized(self):
+        """测试分区构建失败时结果不进入内存缓存，数据源恢复后重新构建"""
+        fetch = self.real_source.query_history_k_data_plus.side_effect
+        self.real_source.query_history_k_data_plus.side_effect = RuntimeError("network error")
+        self.assertTrue(self.ds.query_partition_data("2024-01-01", "2024-01-31").empty)
+
+        self.real_source.query_history_k_data_plus.side_effect = fetch
+        df = self.ds.query_partition_data("2024-01-01", "2024-01-31")
+        self.assertEqual(set(df["code"]), {"sh.600000", "sz.000001"})
+
+    def test_build_partition_reports_failures_once(self):
+        """测试分区内多只股票拉取失败时只汇总输出一次"""
+        self.real_source.query_all_stock.return_value = pd.DataFrame({"code": [f"sz.{i:06d}" for i in range(20)]})
+        self.real_source.query_history_k_data_plus.side_effect = RuntimeError("network error")
+
+        with patch('builtins.print') as mock_print:
+            self.ds.query_partition_data("2024-01-01", "2024-01-31")
+
+        warnings = [c.args[0] for c in mock_print.call_args_list if c.args[0].startswith("Warning")]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("20/20 fetches failed", warnings[0])
+
+    def test_failed_codes_refetched_on_next_query(self):
+        """测试部分股票拉取失败的分区不视为有效，下次查询只补拉失败的股票"""
+        fetch = self.real_source.query_history_k_data_plus.side_effect
+
+        def flaky(code, fields, start_date, end_date, *args):
+            if code == "sz.000001":
+                raise RuntimeError("network error")
+            return fetch(code, fields, start_date, end_date)
+        self.real_source.query_history_k_data_plus.side_effect = flaky
+        self.ds.query_partition_data("2024-01-01", "2024-01-31")
+        partition_file = self.ds._get_partition_file_path("2024-01-01")
+        self.assertFalse(self.ds._is_cache_valid(partition_file))
+
+        self.real_source.query_history_k_data_plus.side_effect = fetch
+        self.real_source.query_history_k_data_plus.reset_mock()
+        df = self.ds.query_partition_data("2024-01-01", "2024-01-31")
+
+        self.assertEqual(set(df["code"]), {"sh.600000", "sz.000001"})
+        self.real_source.query_history_k_data_plus.assert_called_once()
+        self.assertEqual(self.real_source.query_history_k_data_plus.call_args.args[0], "sz.000001")
+        self.assertTrue(self.ds._is_cache_valid(partition_file))
+
+    def test_query_outside_partition_dates_skips_read(self):
+        """测试查询范围与分区footer中的日期范围不相交时不读取数据页"""
+        self.ds.query_partition_data("2024-03-01", "2024-03-31")
+
+        # 2024-03-30/31 为周末，3月分区的最后一个交易日是 03-29
+        with patch('gupiao.ds.parquet.time_partitioned_data_source.pq.read_table') as mock_read:
+            df = self.ds.query_partition_data("2024-03-30", "2024-03-31")
+            mock_read.assert_not_called()
+        self.assertTrue(df.empty)
+
+    def test_partition_rebuilt_by_other_instance_rereads_bounds(self):
+        """测试共享 cache_dir 时其他实例重建分区后，不再按旧的footer日期范围剪枝"""
+        self.real_source.query_history_k_data_plus.side_effect = \
+            lambda code, fields, start_date, end_date, *args: make_k_data([code], start_date, "2024-01-10")
+        self.ds.query_partition_data("2024-01-01", "2024-01-31")
+
+        full_source = MagicMock()
+        full_source.MAX_CONCURRENCY = 4
+        full_source.query_all_stock.return_value = self.real_source.query_all_stock.return_value
+        full_source.query_history_k_data_plus.side_effect = \
+            lambda code, fields, start_date, end_date, *args: make_k_data([code], start_date, end_date)
+        other = TimePartitionedDataSource(full_source, cache_dir=self.temp_dir)
+        other.clear_partition_cache("2024_01")
+        other.query_partition_data("2024-01-01", "2024-01-31")
+
+        df = self.ds.query_partition_data("2024-01-20", "2024-01-31")
+        self.assertEqual(df["date"].max(), pd.Timestamp("2024-01-31"))
+
+    def test_query_across_partitions_with_different_dtypes(self):
+        """测试新旧分区列类型不一致（字符串/数值）时仍能合并读取"""
+        self.ds.query_partition_data("2024-01-01", "2024-01-31", ["sh.600000"])
+        self.real_source.query_history_k_data_plus.side_effect = \
+            lambda code, fields, start_date, end_date, *args: \
+            make_k_data([code], start_date, end_date).astype({"close": float})
+
+        df = self.ds.query_partition_data("2024-01-30", "2024-02-02", ["sh.600000"])
+
+        self.assertEqual(len(df), 4)
+        self.assertEqual(list(df.index), [0, 1, 2, 3])
+
+    def test_history_k_data_reads_ready_partitions(self):
+        """测试大范围单股票查询在分区就绪时直接读取分区，不请求真实数据源"""
+        self.ds.query_partition_data("2024-01-01", "2024-02-29")
+        self.real_source.query_history_k_data_plus.reset_mock()
+
+        df = self.ds.query_history_k_data_plus("sh.600000", "date,code,close", "2024-01-10", "2024-02-20")
+
+        self.real_source.query_history_k_data_plus.assert_not_called()
+        self.assertEqual(list(df.columns), ["date", "code", "close"])
+        self.assertEqual(set(df["code"]), {"sh.600000"})
+
+    def test_history_k_data_partition_types_match_real_source(self):
+        """测试从数值列以字符串保存的分区读取时，列类型与真实数据源的 K_DATA_TYPES 一致"""
+        self.real_source.K_DATA_TYPES = {"date": pa.timestamp("ns"), "close": pa.float64(), "turn": pa.float64()}
+        self.ds.query_partition_data("2024-01-01", "2024-02-29")
+
+        df = self.ds.query_history_k_data_plus("sh.600000", "date,code,close,turn", "2024-01-10", "2024-02-20")
+
+        self.assertEqual(df["close"].dtype, "float64")
+        self.assertEqual(df["turn"].dtype, "float64")
+        self.assertEqual(df["date"].dtype, "datetime64[ns]")
+        self.assertEqual(df["close"].iloc[0], 10.2)
+
+    def test_history_k_data_after_subset_query_covers_other_codes(self):
+        """测试按部分股票查询构建的分区仍包含全市场，其他股票的大范围查询可直接读取分区"""
+        self.ds.query_partition_data("2024-02-01", "2024-03-31", ["sh.600000"])
+        self.real_source.query_history_k_data_plus.reset_mock()
+
+        df = self.ds.query_history_k_data_plus("sz.000001", "date,code,close", "2024-02-01", "2024-03-31")
+
+        self.real_source.query_history_k_data_plus.assert_not_called()
+        self.assertFalse(df.empty)
+        self.assertEqual(set(df["code"]), {"sz.000001"})
+
+    def test_history_k_data_empty_partition_result_keeps_schema(self):
+        """测试分区中没有该股票的数据时返回带请求列、类型与 K_DATA_TYPES 一致的空表"""
+        self.real_source.K_DATA_TYPES = {"date": pa.timestamp("ns"), "close": pa.float64()}
+        self.ds.query_partition_data("2024-01-01", "2024-02-29")
+
+        df = self.ds.query_history_k_data_plus("sh.688999", "date,code,close", "2024-01-10", "2024-02-20")
+
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), ["date", "code", "close"])
+        self.assertEqual(df["date"].dtype, "datetime64[ns]")
+        self.assertEqual(df["close"].dtype, "float64")
+
+    def test_history_k_data_without_partitions_uses_real_source(self):
+        """测试分区未就绪时大范围单股票查询直接走真实数据源，且不构建单股票分区"""
+        df = self.ds.query_history_k_data_plus("sh.600000", "date,code,close", "2024-01-10", "2024-02-20")
+
+        self.real_source.query_history_k_data_plus.assert_called_once_with(
+            "sh.600000", "date,code,close", "2024-01-10", "2024-02-20", "d", "2")
+        self.assertFalse(df.empty)
+        self.assertEqual(self.ds.get_cache_info()["partition_count"], 0)
+
+    def test_partition_without_trading_day_skips_fetch(self):
+        """测试分区内没有交易日时不逐只股票请求数据"""
+        self.real_source.query_trade_dates.return_value = pd.DataFrame(
+            {"calendar_date": ["2024-03-16", "2024-03-17"], "is_trading_day": ["0", "0"]})
+        ds = TimePartitionedDataSource(self.real_source, cache_dir=self.temp_dir, partition_type="daily")
+
+        df = ds.query_partition_data("2024-03-16", "2024-03-17")
+
+        self.assertTrue(df.empty)
+        self.real_source.query_history_k_data_plus.assert_not_called()
+        self.real_source.query_all_stock.assert_not_called()
+
+    def test_repeated_query_hits_memory_cache(self):
+        """测试重复查询命中内存缓存，不再读取Parquet文件"""
+        first = self.ds.query_partition_data("2024-01-15", "2024-02-10", ["sh.600000"])
+
+        with patch('gupiao.ds.parquet.time_partitioned_data_source.pq.read_table') as mock_read:
+            second = self.ds.query_partition_data("2024-01-15", "2024-02-10", ["sh.600000"])
+            mock_read.assert_not_called()
+        pd.testing.assert_frame_equal(first, second)
+
+        # 返回的是副本，调用方修改不影响缓存
+        second.loc[:, "close"] = "0"
+        third = self.ds.query_partition_data("2024-01-15", "2024-02-10", ["sh.600000"])
+        pd.testing.assert_frame_equal(first, third)
+
+    def test_cache_info_and_clear(self):
+        """测试缓存统计与清理"""
+        self.ds.query_partition_data("2024-01-15", "2024-02-10")
+
+        info = self.ds.get_cache_info()
+        self.assertEqual(info["partition_count"], 2)
+        self.assertEqual(sorted(p["partition"] for p in info["partitions"]), ["2024_01", "2024_02"])
+
+        self.ds.clear_partition_cache("2024_01")
+        self.assertEqual(self.ds.get_cache_info()["partition_count"], 1)
+        self.ds.clear_partition_cache()
+        self.assertEqual(self.ds.get_cache_info()["partition_count"], 0)
+
+    def test_cache_info_rebuilds_missing_manifest(self):
+        """测试分区清单丢失时从目录重建"""
+        self.ds.query_partition_data("2024-01-15", "2024-02-10")
+        (self.ds.cache_dir / TimePartitionedDataSource.MANIFEST_NAME).unlink()
+
+        info = self.ds.get_cache_info()
+        self.assertEqual(info["partition_count"], 2)
+        self.assertTrue((self.ds.cache_dir / TimePartitionedDataSource.MANIFEST_NAME).exists())
+
+    def test_shared_cache_dir_manifest_writes(self):
+        """测试共享 cache_dir 的两个实例并发写分区清单不会互相覆盖临时文件"""
+        other = TimePartitionedDataSource(self.real_source, cache_dir=self.temp_dir)
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            futures = [ex.submit(ds._write_manifest, {"2024_01": {"size": i, "mtime": 0}})
+                       for i in range(50) for ds in (self.ds, other)]
+            for future in futures:
+                future.result()
+
+        self.assertEqual(list(self.ds.cache_dir.glob("*.tmp")), [])
+        self.assertEqual(self.ds.get_cache_info()["partition_count"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
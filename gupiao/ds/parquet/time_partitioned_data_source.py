@@ -1,7 +1,13 @@
+import calendar
+import json
+import os
+import threading
 import time
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 import pandas as pd
 import pyarrow as pa
@@ -10,9 +16,88 @@ import pyarrow.parquet as pq
 from gupiao.ds.data_source_interface import DataSourceInterface
 
 
+# ========== 各分区类型的实现 ==========
+# 分区键：日期 "YYYY-MM-DD" -> 分区键；日期范围：日期 -> 所在分区的(起, 止)日期；
+# 起始日期：分区键 -> 分区第一天；分区键列表：查询范围 -> 覆盖的所有分区键
+
+def _yearly_key(date_str: str) -> str:
+    return date_str[:4]  # "2024"
+
+
+def _yearly_range(date_str: str) -> tuple:
+    year = date_str[:4]
+    return f"{year}-01-01", f"{year}-12-31"
+
+
+def _yearly_start(partition_key: str) -> str:
+    return f"{partition_key}-01-01"
+
+
+def _yearly_keys(start_date: str, end_date: str) -> list:
+    return [str(year) for year in range(int(start_date[:4]), int(end_date[:4]) + 1)]
+
+
+def _monthly_key(date_str: str) -> str:
+    return date_str[:7].replace("-", "_")  # "2024-03" -> "2024_03"
+
+
+def _monthly_range(date_str: str) -> tuple:
+    year_month = date_str[:7]
+    last_day = calendar.monthrange(int(year_month[:4]), int(year_month[5:7]))[1]  # 月末最后一天
+    return f"{year_month}-01", f"{year_month}-{last_day:02d}"
+
+
+def _monthly_start(partition_key: str) -> str:
+    return partition_key.replace("_", "-") + "-01"  # "2024_03" -> "2024-03-01"
+
+
+def _monthly_keys(start_date: str, end_date: str) -> list:
+    return list(pd.period_range(start_date[:7], end_date[:7], freq="M").strftime("%Y_%m"))
+
+
+def _daily_key(date_str: str) -> str:
+    return date_str.replace("-", "_")  # "2024-03-15" -> "2024_03_15"
+
+
+def _daily_range(date_str: str) -> tuple:
+    return date_str, date_str
+
+
+def _daily_start(partition_key: str) -> str:
+    return partition_key.replace("_", "-")
+
+
+def _daily_keys(start_date: str, end_date: str) -> list:
+    return list(pd.date_range(start_date, end_date, freq="D").strftime("%Y_%m_%d"))
+
+
+# 分区类型 -> (分区键, 日期范围, 起始日期, 分区键列表)，在 __init__ 中按 partition_type 解析一次
+PARTITION_SCHEMES = {
+    "yearly": (_yearly_key, _yearly_range, _yearly_start, _yearly_keys),
+    "monthly": (_monthly_key, _monthly_range, _monthly_start, _monthly_keys),
+    "daily": (_daily_key, _daily_range, _daily_start, _daily_keys),
+}
+
+
 class TimePartitionedDataSource(DataSourceInterface):
     """时间分区数据源实现 - 优化大量数据的时间范围查询性能"""
 
+    IO_WORKERS = min(8, os.cpu_count() or 1)  # 并发读取分区文件的线程数
+    FETCH_WORKERS = 8  # 构建分区时并发拉取K线的线程数上限（再受真实数据源的 MAX_CONCURRENCY 限制）
+    PARTITION_FIELDS = "date,code,open,high,low,close,volume,amount,turn"  # 分区文件中保存的K线字段
+    MEM_CACHE_ENTRIES = 256  # query_partition_data 结果的内存LRU缓存条目数
+    MANIFEST_NAME = ".manifest.json"  # 分区文件清单，get_cache_info 直接读取而无需遍历目录
+    COMPRESSION = "zstd"  # 分区文件压缩算法：比snappy体积小20%~40%，解压速度相近
+    COMPRESSION_LEVEL = 3
+
+    # 不做分区优化、直接转发给真实数据源的接口
+    PASSTHROUGH_METHODS = (
+        "query_all_stock", "query_stock_basic", "query_stock_basic_many", "query_trade_dates",
+        "query_stock_industry", "query_sz50_stocks", "query_hs300_stocks", "query_zz500_stocks",
+        "query_dividend_data", "query_profit_data", "query_operation_data", "query_growth_data",
+        "query_balance_data", "query_cash_flow_data",
+    )
+
     def __init__(self, real_source: DataSourceInterface, cache_dir: str = "cache",
                  partition_type: str = "monthly", cache_days: int = 1):
         """
@@ -24,24 +109,32 @@ class TimePartitionedDataSource(DataSourceInterface):
             partition_type: 分区类型 ("monthly", "yearly", "daily")
             cache_days: 缓存有效期（天），0表示永不过期
         """
+        if partition_type not in PARTITION_SCHEMES:
+            raise ValueError(f"Unsupported partition_type: {partition_type}")
         self.real_source = real_source
         self.cache_dir = Path(cache_dir)
         self.partition_type = partition_type
+        (self._partition_key_fn, self._partition_range_fn,
+         self._partition_start_fn, self._partition_keys_fn) = PARTITION_SCHEMES[partition_type]
         self.cache_days = cache_days
 
+        # 直接绑定真实数据源的方法到实例上，调用时不再经过一层转发
+        for name in self.PASSTHROUGH_METHODS:
+            setattr(self, name, getattr(real_source, name))
+
+        # query_partition_data 结果的内存LRU缓存：key -> (写入时间, DataFrame)
+        self._mem_cache = OrderedDict()
+        self._mem_lock = threading.Lock()
+        self._manifest_lock = threading.Lock()
+        # 分区文件footer中date列的(min, max)：path -> ((mtime_ns, size), (min, max))，文件变化后重新读取
+        self._partition_stats = {}
+
         # 创建缓存目录
         self.cache_dir.mkdir(exist_ok=True)
 
     def _get_partition_key(self, date_str: str) -> str:
         """根据日期生成分区键"""
-        if self.partition_type == "yearly":
-            return date_str[:4]  # "2024"
-        elif self.partition_type == "monthly":
-            return date_str[:7].replace("-", "_")  # "2024-03" -> "2024_03"
-        elif self.partition_type == "daily":
-            return date_str.replace("-", "_")  # "2024-03-15" -> "2024_03_15"
-        else:
-            raise ValueError(f"Unsupported partition_type: {self.partition_type}")
+        return self._partition_key_fn(date_str)
 
     def _get_partition_file_path(self, date_str: str) -> Path:
         """获取分区文件路径"""
@@ -49,82 +142,146 @@ class TimePartitionedDataSource(DataSourceInterface):
         return self.cache_dir / f"partition_{partition_key}.parquet"
 
     def _is_cache_valid(self, cache_path: Path) -> bool:
-        """检查缓存是否有效"""
-        if not cache_path.exists():
+        """检查缓存是否有效：文件未过期，且没有构建时拉取失败、待补拉的股票"""
+        return self._is_cache_fresh(cache_path) and not self._failed_codes_path(cache_path).exists()
+
+    def _is_cache_fresh(self, cache_path: Path) -> bool:
+        """检查缓存文件是否存在且未过期（只做一次stat）"""
+        try:
+            mtime = cache_path.stat().st_mtime
+        except FileNotFoundError:
             return False
 
         if self.cache_days == 0:  # 永不过期
             return True
 
-        cache_age = time.time() - cache_path.stat().st_mtime
+        cache_age = time.time() - mtime
         return cache_age < (self.cache_days * 24 * 3600)
 
+    @staticmethod
+    def _failed_codes_path(partition_file: Path) -> Path:
+        """分区构建时拉取失败的股票代码清单：partition_2024_03.parquet -> partition_2024_03.failed.json"""
+        return partition_file.with_name(partition_file.name[:-len(".parquet")] + ".failed.json")
+
+    def _read_failed_codes(self, partition_file: Path) -> Optional[List[str]]:
+        """读取分区待补拉的股票代码，没有清单时返回None"""
+        try:
+            with open(self._failed_codes_path(partition_file), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_failed_codes(self, partition_file: Path, codes: List[str]):
+        """记录分区待补拉的股票代码，全部成功时删除清单"""
+        path = self._failed_codes_path(partition_file)
+        if codes:
+            self._atomic_write_json(path, sorted(codes))
+        else:
+            path.unlink(missing_ok=True)
+
     def _get_date_range_for_partition(self, date_str: str) -> tuple:
         """获取分区对应的日期范围"""
-        if self.partition_type == "yearly":
-            year = date_str[:4]
-            return f"{year}-01-01", f"{year}-12-31"
-        elif self.partition_type == "monthly":
-            year_month = date_str[:7]
-            year, month = int(year_month[:4]), int(year_month[5:7])
-
-            # 计算月末最后一天
-            import calendar
-            last_day = calendar.monthrange(year, month)[1]
-
-            return f"{year_month}-01", f"{year_month}-{last_day:02d}"
-        elif self.partition_type == "daily":
-            return date_str, date_str
-        else:
-            raise ValueError(f"Unsupported partition_type: {self.partition_type}")
+        return self._partition_range_fn(date_str)
 
-    def _build_partition_cache(self, date_str: str, stock_codes: Optional[List[str]] = None):
-        """构建分区缓存"""
+    def _build_partition_cache(self, date_str: str) -> bool:
+        """
+        构建全市场的分区缓存，返回分区是否完整（全部拉取成功，或分区内没有交易日无需拉取）
+        分区总是包含全部股票，有效分区可以直接回答任意股票的查询；
+        部分股票拉取失败时仍写入分区，失败的代码记入清单；分区在清单清空前不视为有效，
+        下次构建只补拉清单中的股票并与已有数据合并
+        """
         partition_file = self._get_partition_file_path(date_str)
 
         if self._is_cache_valid(partition_file):
-            return
+            return True
+
+        # 未过期但有待补拉股票的分区：只补拉失败的代码
+        existing = None
+        stock_codes = None
+        if self._is_cache_fresh(partition_file):
+            retry_codes = self._read_failed_codes(partition_file)
+            if retry_codes is not None:
+                existing = pd.read_parquet(partition_file)
+                stock_codes = retry_codes
 
         print(f"Building partition cache for {self._get_partition_key(date_str)}...")
 
         start_date, end_date = self._get_date_range_for_partition(date_str)
 
+        # 分区内没有交易日（如按日分区的周末、节假日）时不逐只股票请求
+        if not self._has_trading_day(start_date, end_date):
+            print(f"No trading day in partition {self._get_partition_key(date_str)}, skipped")
+            return True
+
         # 获取股票列表
         if stock_codes is None:
             all_stocks = self.query_all_stock()
-            stock_codes = all_stocks['code'].tolist() if not all_stocks.empty else []
+            stock_codes = all_stocks['code'].to_numpy(dtype=object).tolist() if len(all_stocks) else []
 
-        # 收集该分区的所有数据
+        # 收集该分区的所有数据：逐只股票的请求是网络IO，用线程池并发拉取
+        # 直接调用真实数据源，避免大范围分区（如按年）再次走分区查询
         all_partition_data = []
-
-        for code in stock_codes:
-            try:
-                stock_data = self.query_history_k_data_plus(
-                    code,
-                    "date,code,open,high,low,close,volume,amount,turn",
-                    start_date,
-                    end_date
-                )
-                if not stock_data.empty:
+        workers = max(1, min(self.FETCH_WORKERS, self.real_source.MAX_CONCURRENCY, len(stock_codes)))
+
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = {
+                ex.submit(self.real_source.query_history_k_data_plus,
+                          code, self.PARTITION_FIELDS, start_date, end_date): code
+                for code in stock_codes
+            }
+            # 失败只计数，整个分区结束后汇总输出一次，避免网络异常时逐只股票刷屏
+            failed = []
+            last_err = None
+            for future in as_completed(futures):
+                try:
+                    stock_data = future.result()
+                except Exception as e:
+                    failed.append(futures[future])
+                    last_err = e
+                    continue
+                if len(stock_data):
                     all_partition_data.append(stock_data)
-            except Exception as e:
-                print(f"Warning: Failed to fetch data for {code}: {e}")
-                continue
+
+        if failed:
+            print(f"Warning: Partition {self._get_partition_key(date_str)}: {len(failed)}/{len(stock_codes)} "
+                  f"fetches failed (e.g. {', '.join(failed[:5])}), last error: {last_err}")
+
+        if existing is not None:
+            all_partition_data.insert(0, existing)
 
         if all_partition_data:
             # 合并所有数据
             partition_data = pd.concat(all_partition_data, ignore_index=True)
 
-            # 数据类型优化和排序
+            # 数据类型优化和排序：按(code, date)排序，同一股票的行连续存放，
+            # code列的字典编码/RLE更紧凑，row group的code统计信息也更窄，按股票过滤时可跳过更多row group
             partition_data['date'] = pd.to_datetime(partition_data['date'])
-            partition_data = partition_data.sort_values(['date', 'code'])
+            partition_data = partition_data.sort_values(['code', 'date'], ignore_index=True)
 
+            # 有失败时先写清单再替换分区文件，全部成功时替换后再删清单，其他实例不会把部分数据当作完整分区
+            if failed:
+                self._write_failed_codes(partition_file, failed)
             # 使用PyArrow优化存储
             self._save_optimized_parquet(partition_data, partition_file)
+            if not failed:
+                self._write_failed_codes(partition_file, failed)
+            self._mem_cache_clear()
 
             print(f"Partition cache built: {partition_file}, {len(partition_data)} records")
-        else:
-            print(f"No data found for partition {self._get_partition_key(date_str)}")
+            return not failed
+
+        print(f"No data found for partition {self._get_partition_key(date_str)}")
+        return False
+
+    def _has_trading_day(self, start_date: str, end_date: str) -> bool:
+        """日期范围内是否有交易日（交易日历由真实数据源缓存）；日历不可用时按有交易日处理"""
+        try:
+            trade_dates = self.query_trade_dates(start_date, end_date)
+        except Exception:
+            return True
+        if 'is_trading_day' not in trade_dates.columns:
+            return True
+        return bool((trade_dates['is_trading_day'] == '1').any())
 
     def _save_optimized_parquet(self, df: pd.DataFrame, file_path: Path):
         """以优化的格式保存Parquet文件"""
@@ -133,13 +290,17 @@ class TimePartitionedDataSource(DataSourceInterface):
         pq.write_table(
             table,
             file_path,
-            compression='snappy',
+            compression=self.COMPRESSION,
+            compression_level=self.COMPRESSION_LEVEL,
             row_group_size=50000,  # 控制row group大小
             write_statistics=True   # 启用统计信息，支持谓词下推
         )
+        self._partition_stats.pop(file_path, None)
+        self._update_manifest(file_path)
 
     def query_partition_data(self, start_date: str, end_date: str,
-                           stock_codes: Optional[List[str]] = None) -> pd.DataFrame:
+                           stock_codes: Optional[List[str]] = None,
+                           columns: Optional[List[str]] = None) -> pd.DataFrame:
         """
         查询分区数据 - 核心优化方法
 
@@ -147,110 +308,159 @@ class TimePartitionedDataSource(DataSourceInterface):
             start_date: 开始日期 "YYYY-MM-DD"
             end_date: 结束日期 "YYYY-MM-DD"
             stock_codes: 股票代码列表，None表示查询所有股票
+            columns: 需要读取的列，None表示读取所有列
 
         Returns:
             查询结果DataFrame
         """
+        mem_key = (start_date, end_date,
+                   tuple(stock_codes) if stock_codes else None, tuple(columns) if columns else None)
+        df = self._mem_cache_get(mem_key)
+        if df is not None:
+            return df.copy()
+
+        df, complete = self._query_partition_files(start_date, end_date, stock_codes, columns)
+        # 分区构建失败或只拿到部分数据时不放入内存缓存，下次查询重新尝试构建
+        if complete:
+            self._mem_cache_put(mem_key, df)
+        return df.copy()
+
+    def _mem_cache_get(self, key):
+        with self._mem_lock:
+            item = self._mem_cache.get(key)
+            if item is None:
+                return None
+            created, df = item
+            if self.cache_days and time.time() - created >= self.cache_days * 24 * 3600:
+                del self._mem_cache[key]
+                return None
+            self._mem_cache.move_to_end(key)
+            return df
+
+    def _mem_cache_put(self, key, df: pd.DataFrame):
+        with self._mem_lock:
+            self._mem_cache[key] = (time.time(), df)
+            self._mem_cache.move_to_end(key)
+            while len(self._mem_cache) > self.MEM_CACHE_ENTRIES:
+                self._mem_cache.popitem(last=False)
+
+    def _mem_cache_clear(self):
+        with self._mem_lock:
+            self._mem_cache.clear()
+
+    def _query_partition_files(self, start_date: str, end_date: str,
+                               stock_codes: Optional[List[str]] = None,
+                               columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, bool]:
+        """读取分区文件（缺失或过期的分区先构建），返回(结果, 是否所有分区都完整)"""
         # 确定需要读取的分区文件
         partition_files = self._get_partition_files_for_range(start_date, end_date)
 
-        all_data = []
-
+        # 有效的分区必然存在，只有刚重建的分区才需要再确认文件是否生成（无数据时不会生成）
+        existing_files = []
+        complete = True
         for partition_file in partition_files:
             if not self._is_cache_valid(partition_file):
                 # 构建缓存
                 partition_date = self._extract_date_from_partition_file(partition_file)
-                self._build_partition_cache(partition_date, stock_codes)
-
-            if partition_file.exists():
-                try:
-                    # 使用PyArrow的谓词下推进行高效过滤
-                    # 将字符串日期转换为datetime对象用于PyArrow过滤
-                    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-                    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-
-                    filters = [
-                        ('date', '>=', start_dt),
-                        ('date', '<=', end_dt)
-                    ]
+                complete &= self._build_partition_cache(partition_date)
+                if not partition_file.exists():
+                    continue
+            existing_files.append(partition_file)
 
-                    table = pq.read_table(partition_file, filters=filters)
-                    df = table.to_pandas()
+        # 将字符串日期转换为datetime对象用于PyArrow过滤
+        start_dt = datetime.fromisoformat(start_date)
+        end_dt = datetime.fromisoformat(end_date)
 
-                    # Filter by stock codes in pandas (more flexible than PyArrow filters)
-                    if stock_codes and not df.empty:
-                        df = df[df['code'].isin(stock_codes)]
+        # 先按footer统计信息剔除日期范围不相交的分区（如只落在节假日的查询），不读数据页
+        existing_files = [f for f in existing_files if self._partition_overlaps(f, start_dt, end_dt)]
+        if not existing_files:
+            return pd.DataFrame(), complete
 
-                    if not df.empty:
-                        all_data.append(df)
+        # 使用PyArrow的谓词下推进行高效过滤，日期与股票代码条件都在读取时完成
+        filters = [('date', '>=', start_dt), ('date', '<=', end_dt)]
+        if stock_codes:
+            filters.append(('code', 'in', list(stock_codes)))
 
-                except Exception as e:
-                    print(f"Error reading partition {partition_file}: {e}")
-                    continue
-
-        return pd.concat(all_data, ignore_index=True) if all_data else pd.DataFrame()
+        # 多个分区并发读取：PyArrow读文件和解压时会释放GIL
+        if len(existing_files) == 1:
+            tables = [self._read_partition(existing_files[0], filters, columns)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.IO_WORKERS, len(existing_files))) as ex:
+                tables = list(ex.map(lambda f: self._read_partition(f, filters, columns), existing_files))
+
+        # 读取失败的分区同样视为不完整
+        complete &= all(t is not None for t in tables)
+
+        # 在Arrow层合并后一次性转换为DataFrame，不为每个分区生成中间DataFrame
+        tables = [t for t in tables if t is not None and t.num_rows]
+        if not tables:
+            return pd.DataFrame(), complete
+        try:
+            table = pa.concat_tables(tables, promote_options="permissive")
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 新旧分区的列类型不一致（如数值列曾以字符串保存）时，逐个转换后由pandas合并
+            return pd.concat([t.to_pandas() for t in tables], ignore_index=True), complete
+        # split_blocks/self_destruct：逐列转换并及时释放Arrow缓冲区，避免合并成大块时的额外拷贝
+        return table.to_pandas(split_blocks=True, self_destruct=True), complete
+
+    def _partition_date_bounds(self, partition_file: Path):
+        """
+        读取分区footer统计信息得到date列的(min, max)，缺少统计信息时返回None
+        缓存按文件的 (mtime_ns, size) 校验：共享 cache_dir 时其他实例/进程重建的分区会重新读取footer
+        """
+        try:
+            st = partition_file.stat()
+        except OSError:
+            return None
+        stat_key = (st.st_mtime_ns, st.st_size)
+        cached = self._partition_stats.get(partition_file)
+        if cached is not None and cached[0] == stat_key:
+            return cached[1]
+
+        bounds = None
+        try:
+            metadata = pq.read_metadata(partition_file)
+            col = metadata.schema.names.index('date')
+            stats = [metadata.row_group(i).column(col).statistics for i in range(metadata.num_row_groups)]
+            if stats and all(st is not None and st.has_min_max for st in stats):
+                bounds = (min(st.min for st in stats), max(st.max for st in stats))
+        except (OSError, ValueError, pa.ArrowException):
+            pass
+
+        self._partition_stats[partition_file] = (stat_key, bounds)
+        return bounds
+
+    def _partition_overlaps(self, partition_file: Path, start_dt: datetime, end_dt: datetime) -> bool:
+        """分区的日期范围是否与查询范围相交；无法判断时按相交处理"""
+        bounds = self._partition_date_bounds(partition_file)
+        if bounds is None:
+            return True
+        lo, hi = bounds
+        return lo <= end_dt and hi >= start_dt
+
+    def _read_partition(self, partition_file: Path, filters: list,
+                        columns: Optional[List[str]] = None) -> Optional[pa.Table]:
+        """读取单个分区文件（列裁剪 + 谓词下推），读取失败时返回None"""
+        try:
+            table = pq.read_table(partition_file, columns=columns, filters=filters)
+        except Exception as e:
+            print(f"Error reading partition {partition_file}: {e}")
+            return None
+
+        # 去掉写入时保存的pandas索引，合并后的结果统一使用默认索引
+        index_columns = [name for name in table.column_names if name.startswith("__index_level_")]
+        return table.drop_columns(index_columns).replace_schema_metadata(None)
 
     def _get_partition_files_for_range(self, start_date: str, end_date: str) -> List[Path]:
         """获取日期范围内需要的分区文件列表"""
-        files = []
-
-        if self.partition_type == "monthly":
-            # 按月遍历 - 使用更简洁的方法
-            start_year, start_month = int(start_date[:4]), int(start_date[5:7])
-            end_year, end_month = int(end_date[:4]), int(end_date[5:7])
-
-            current_year, current_month = start_year, start_month
-
-            while (current_year, current_month) <= (end_year, end_month):
-                date_str = f"{current_year:04d}-{current_month:02d}-01"
-                files.append(self._get_partition_file_path(date_str))
-
-                # 移动到下一个月
-                if current_month == 12:
-                    current_year += 1
-                    current_month = 1
-                else:
-                    current_month += 1
-
-        elif self.partition_type == "yearly":
-            # 按年遍历
-            start_year = int(start_date[:4])
-            end_year = int(end_date[:4])
-
-            for year in range(start_year, end_year + 1):
-                date_str = f"{year}-01-01"
-                files.append(self._get_partition_file_path(date_str))
-
-        elif self.partition_type == "daily":
-            # 按日遍历
-            current = datetime.strptime(start_date, "%Y-%m-%d")
-            end = datetime.strptime(end_date, "%Y-%m-%d")
-
-            while current <= end:
-                date_str = current.strftime("%Y-%m-%d")
-                files.append(self._get_partition_file_path(date_str))
-                current += timedelta(days=1)
-
-        return files
+        return [self.cache_dir / f"partition_{key}.parquet" for key in self._partition_keys_fn(start_date, end_date)]
 
     def _extract_date_from_partition_file(self, partition_file: Path) -> str:
-        """从分区文件路径提取日期"""
-        filename = partition_file.stem
-        # partition_2024_03.parquet -> 2024_03 -> 2024-03-01
-        partition_key = filename.replace("partition_", "")
-
-        if self.partition_type == "monthly":
-            year, month = partition_key.split("_")
-            return f"{year}-{month}-01"
-        elif self.partition_type == "yearly":
-            return f"{partition_key}-01-01"
-        elif self.partition_type == "daily":
-            parts = partition_key.split("_")
-            return f"{parts[0]}-{parts[1]}-{parts[2]}"
-
-        return partition_key
+        """从分区文件路径提取日期：partition_2024_03.parquet -> 2024_03 -> 2024-03-01"""
+        return self._partition_start_fn(self._partition_key_of(partition_file.name))
 
     # ================== 实现DataSourceInterface接口 ==================
+    # 以下转发方法在实例上会被 __init__ 绑定的真实数据源方法覆盖，保留用于满足接口定义
 
     def query_all_stock(self, date=None) -> pd.DataFrame:
         """查询所有股票列表"""
@@ -260,6 +470,10 @@ class TimePartitionedDataSource(DataSourceInterface):
         """查询股票基本信息"""
         return self.real_source.query_stock_basic(code)
 
+    def query_stock_basic_many(self, codes: list) -> pd.DataFrame:
+        """批量查询股票基本信息"""
+        return self.real_source.query_stock_basic_many(codes)
+
     def query_trade_dates(self, start_date: str, end_date: str) -> pd.DataFrame:
         """查询交易日期"""
         return self.real_source.query_trade_dates(start_date, end_date)
@@ -269,20 +483,45 @@ class TimePartitionedDataSource(DataSourceInterface):
         """
         查询历史K线数据 - 支持时间分区优化
 
-        对于大范围查询，使用分区查询优化性能
-        对于单股票小范围查询，直接使用原始数据源
+        大范围查询且分区缓存已全部就绪时，直接从分区文件按代码读取
+        其他情况（小范围、分区未就绪、字段/频率/复权方式与分区不一致）直接使用原始数据源，
+        不为单只股票构建分区，避免生成只含一只股票、却被其他查询当作完整缓存的分区文件
         """
         # 判断是否使用分区查询
-        date_diff = (datetime.strptime(end_date, "%Y-%m-%d") -
-                    datetime.strptime(start_date, "%Y-%m-%d")).days
+        date_diff = (datetime.fromisoformat(end_date) - datetime.fromisoformat(start_date)).days
 
-        if date_diff > 30:  # 超过30天使用分区查询
-            return self.query_partition_data(start_date, end_date, [code])
-        else:
-            # 小范围查询直接使用原始数据源
-            return self.real_source.query_history_k_data_plus(
-                code, fields, start_date, end_date, frequency, adjustflag
-            )
+        if date_diff > 30 and frequency == "d" and adjustflag == "2":  # 超过30天使用分区查询
+            partition_fields = self.PARTITION_FIELDS.split(",")
+            columns = fields.split(",")
+            if (all(f in partition_fields for f in columns) and
+                    all(self._is_cache_valid(f) for f in self._get_partition_files_for_range(start_date, end_date))):
+                return self._cast_k_data(self.query_partition_data(start_date, end_date, [code], columns), columns)
+
+        return self.real_source.query_history_k_data_plus(
+            code, fields, start_date, end_date, frequency, adjustflag
+        )
+
+    def _cast_k_data(self, df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+        """
+        按真实数据源的 K_DATA_TYPES 转换分区读出的列类型
+        旧分区中数值列以字符串保存，转换后与直接请求真实数据源得到的类型一致；空串等无法解析的值记为缺失。
+        没有数据时返回带请求列、类型同样对齐的空表
+        """
+        types = getattr(self.real_source, "K_DATA_TYPES", None) or {}
+        if df.empty:
+            df = pd.DataFrame({col: pd.Series(dtype=types[col].to_pandas_dtype() if col in types else object)
+                               for col in columns})
+        for col in df.columns:
+            if col not in types:
+                continue
+            dtype = types[col].to_pandas_dtype()
+            if df[col].dtype == dtype:
+                continue
+            if pa.types.is_timestamp(types[col]):
+                df[col] = pd.to_datetime(df[col], errors="coerce").astype(dtype)
+            else:
+                df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+        return df
 
     def query_stock_industry(self, date=None) -> pd.DataFrame:
         """查询股票行业信息"""
@@ -333,34 +572,109 @@ class TimePartitionedDataSource(DataSourceInterface):
         Args:
             partition_key: 分区键，如"2024_03"，None表示清理所有缓存
         """
+        self._mem_cache_clear()
         if partition_key:
             cache_file = self.cache_dir / f"partition_{partition_key}.parquet"
+            self._partition_stats.pop(cache_file, None)
+            self._failed_codes_path(cache_file).unlink(missing_ok=True)
             if cache_file.exists():
                 cache_file.unlink()
                 print(f"Cleared cache: {cache_file}")
+            self._update_manifest(cache_file)
         else:
-            for cache_file in self.cache_dir.glob("partition_*.parquet"):
-                cache_file.unlink()
-                print(f"Cleared cache: {cache_file}")
+            self._partition_stats.clear()
+            for entry in self._scan_partition_files():
+                self._failed_codes_path(Path(entry.path)).unlink(missing_ok=True)
+                os.unlink(entry.path)
+                print(f"Cleared cache: {entry.path}")
+            with self._manifest_lock:
+                self._write_manifest({})
+
+    def _scan_partition_files(self):
+        """遍历缓存目录中的分区文件；scandir 的目录项自带文件类型且缓存stat结果，每个文件最多一次stat"""
+        with os.scandir(self.cache_dir) as it:
+            return [entry for entry in it
+                    if entry.name.startswith("partition_") and entry.name.endswith(".parquet")
+                    and entry.is_file(follow_symlinks=False)]
+
+    @staticmethod
+    def _partition_key_of(file_name: str) -> str:
+        """partition_2024_03.parquet -> 2024_03"""
+        return file_name[len("partition_"):-len(".parquet")]
+
+    def _write_manifest(self, manifest: dict):
+        """原子写入分区清单"""
+        self._atomic_write_json(self.cache_dir / self.MANIFEST_NAME, manifest)
+
+    @staticmethod
+    def _atomic_write_json(path: Path, obj):
+        """原子写入JSON文件（先写临时文件再替换）"""
+        # 临时文件名带进程号和线程号：共享同一 cache_dir 的多个实例/进程不会互相覆盖临时文件
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(obj, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _rebuild_manifest(self) -> dict:
+        """遍历目录重建分区清单"""
+        manifest = {}
+        for entry in self._scan_partition_files():
+            st = entry.stat()
+            manifest[self._partition_key_of(entry.name)] = {"size": st.st_size, "mtime": st.st_mtime}
+        self._write_manifest(manifest)
+        return manifest
+
+    def _read_manifest(self) -> Optional[dict]:
+        """读取分区清单文件，缺失或损坏时返回None"""
+        try:
+            with open(self.cache_dir / self.MANIFEST_NAME, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load_manifest(self) -> dict:
+        """读取分区清单，清单缺失或损坏时自动重建（调用方需持有 _manifest_lock）"""
+        manifest = self._read_manifest()
+        return manifest if manifest is not None else self._rebuild_manifest()
+
+    def _update_manifest(self, file_path: Path):
+        """分区文件写入或删除后增量更新清单"""
+        with self._manifest_lock:
+            manifest = self._load_manifest()
+            partition_key = self._partition_key_of(file_path.name)
+            try:
+                st = file_path.stat()
+                manifest[partition_key] = {"size": st.st_size, "mtime": st.st_mtime}
+            except FileNotFoundError:
+                manifest.pop(partition_key, None)
+            self._write_manifest(manifest)
 
     def get_cache_info(self) -> dict:
-        """获取缓存统计信息"""
-        cache_files = list(self.cache_dir.glob("partition_*.parquet"))
-        total_size = sum(f.stat().st_size for f in cache_files)
+        """获取缓存统计信息（读取分区清单，不遍历目录）"""
+        # 清单通过 os.replace 原子替换，读者总能看到完整的新旧版本之一，无需与写者互斥；
+        # 只有清单缺失需要重建时才加锁
+        manifest = self._read_manifest()
+        if manifest is None:
+            with self._manifest_lock:
+                manifest = self._load_manifest()
+        total_size = sum(item["size"] for item in manifest.values())
 
         partitions = []
-        for f in cache_files:
-            partition_key = f.stem.replace("partition_", "")
+        for partition_key, item in manifest.items():
             partitions.append({
                 "partition": partition_key,
-                "size_mb": round(f.stat().st_size / 1024 / 1024, 2),
-                "modified": datetime.fromtimestamp(f.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+                "size_mb": round(item["size"] / 1024 / 1024, 2),
+                "modified": datetime.fromtimestamp(item["mtime"]).strftime("%Y-%m-%d %H:%M:%S")
             })
 
         return {
             "cache_dir": str(self.cache_dir),
             "partition_type": self.partition_type,
-            "partition_count": len(cache_files),
+            "partition_count": len(manifest),
             "total_size_mb": round(total_size / 1024 / 1024, 2),
             "cache_days": self.cache_days,
             "partitions": partitions
@@ -1,32 +1,198 @@
+import os
+import random
+import threading
 import time
 from abc import ABC, abstractmethod
+from collections import deque
+from functools import wraps
+
+import pandas as pd
+import requests
+
+# 熔断器状态
+CLOSED = "CLOSED"        # 正常放行
+OPEN = "OPEN"            # 熔断中，直接拒绝
+HALF_OPEN = "HALF_OPEN"  # 冷却结束，只放行一个探测请求
+
+# 可重试的HTTP状态码：限流与服务端临时故障
+TRANSIENT_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class InvalidRequestError(ValueError):
+    """请求参数本身有误（如日期格式错误），与数据源健康无关，重试无意义"""
+
+
+def is_transient(exc: Exception) -> bool:
+    """
+    判断异常是否为可重试的临时性错误：网络错误、限流与服务端临时故障，
+    以及解析类错误（ValueError/KeyError/TypeError）——被限流或返回残缺数据时 akshare 通常抛出这类错误
+    """
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in TRANSIENT_STATUS
+    if isinstance(exc, InvalidRequestError):
+        return False
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError,
+                            ValueError, KeyError, TypeError))
+
+
+def is_permanent(exc: Exception) -> bool:
+    """
+    判断异常是否与数据源健康无关：非限流的 4xx（参数错误/无权限/不存在）以及显式的参数校验错误，
+    这类错误重试和熔断都无意义
+    """
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and 400 <= exc.response.status_code < 500 \
+            and exc.response.status_code != 429
+    return isinstance(exc, InvalidRequestError)
+
+
+_rng_local = threading.local()
+
+
+def _thread_rng() -> random.Random:
+    """每个线程独立的随机数生成器，批量并发重试时不争用模块级 random 的共享状态"""
+    rng = getattr(_rng_local, "rng", None)
+    if rng is None:
+        rng = _rng_local.rng = random.Random(os.urandom(16))
+    return rng
+
+
+def retry_transient(method):
+    """
+    装饰器：仅对临时性错误做指数退避重试（full jitter）。
+    重试次数与等待时间取实例的 RETRY_ATTEMPTS / RETRY_BASE / RETRY_MAX_WAIT。
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        attempts = self.RETRY_ATTEMPTS
+        for attempt in range(attempts):
+            try:
+                return method(self, *args, **kwargs)
+            except Exception as e:
+                if attempt == attempts - 1 or not is_transient(e):
+                    raise
+                time.sleep(_thread_rng().uniform(0, min(self.RETRY_MAX_WAIT, self.RETRY_BASE * 2 ** attempt)))
+
+    return wrapper
+
+
+def circuit_guard(method):
+    """
+    装饰器：给数据源方法套上熔断器。
+    熔断中直接返回空 DataFrame；调用成功/失败分别记录到熔断器。
+    永久性错误（请求本身有误）记录后原样抛出，其余失败计入熔断并返回空 DataFrame。
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # CLOSED 时只做一次属性比较，不进入 allow_request
+        if self.state is not CLOSED and not self.allow_request():
+            return pd.DataFrame()
+        try:
+            result = method(self, *args, **kwargs)
+            self.record_success()
+            return result
+        except Exception as e:
+            if is_permanent(e):
+                self.record_permanent_failure(f"{method.__name__}: {e!r}")
+                raise
+            self.record_failure(str(e))
+            return pd.DataFrame()
+
+    return wrapper
+
 
 class StockDataSource(ABC):
-    def __init__(self, cooldown=60, max_fail=3):
+    RETRY_ATTEMPTS = 4  # 临时性错误最多尝试次数
+    RETRY_BASE = 0.3  # 退避基数（秒）
+    RETRY_MAX_WAIT = 5  # 单次退避上限（秒）
+
+    def __init__(self, cooldown=60, max_fail=3, max_cooldown=600, failure_window=60):
         """
         :param cooldown: 冷却秒数（连续失败后暂停多久）
         :param max_fail: 最大失败次数，超过后触发冷却
+        :param max_cooldown: 冷却时间上限，探测失败后冷却时间按指数增长直到该值
+        :param failure_window: 失败统计窗口（秒），只有窗口内的失败次数达到 max_fail 才触发冷却
         """
-        self.fail_count = 0
-        self.cooldown_until = 0
+        self.fail_count = 0  # 统计窗口内的失败次数
+        self.failure_window = failure_window
+        self._failures = deque(maxlen=max_fail)  # 最近失败的时间戳（单调时钟）
+        self.permanent_fail_count = 0
+        self.cooldown_until = 0  # 冷却结束时刻（单调时钟）
         self.cooldown = cooldown
         self.max_fail = max_fail
+        self.max_cooldown = max_cooldown
+        self.state = CLOSED
+        self._trips = 0  # 连续熔断次数，用于计算指数冷却时间
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _open(self, reason):
+        self.state = OPEN
+        self._trips += 1
+        wait = min(self.cooldown * 2 ** (self._trips - 1), self.max_cooldown)
+        self.cooldown_until = time.monotonic() + wait
+        print(f"[COOLDOWN] {self.__class__.__name__} 进入冷却 {wait}s, 原因: {reason}")
 
     def record_success(self):
         """请求成功，清除失败状态"""
-        self.fail_count = 0
-        self.cooldown_until = 0
+        # 健康状态下没有需要清除的内容，成功路径不加锁
+        if self.state is CLOSED and self.fail_count == 0:
+            return
+        with self._lock:
+            self._failures.clear()
+            self.fail_count = 0
+            self.cooldown_until = 0
+            self.state = CLOSED
+            self._trips = 0
+            self._probing = False
 
     def record_failure(self, reason: str = None):
         """记录一次失败，并决定是否进入冷却"""
-        self.fail_count += 1
-        if self.fail_count >= self.max_fail:
-            self.cooldown_until = time.time() + self.cooldown
-            print(f"[COOLDOWN] {self.__class__.__name__} 进入冷却 {self.cooldown}s, 原因: {reason}")
+        with self._lock:
+            now = time.monotonic()
+            self._failures.append(now)
+            while now - self._failures[0] > self.failure_window:
+                self._failures.popleft()
+            self.fail_count = len(self._failures)
+            if self.state == HALF_OPEN:
+                self._probing = False
+                self._open(reason)
+            elif self.state == CLOSED and self.fail_count >= self.max_fail:
+                self._open(reason)
+
+    def record_permanent_failure(self, reason: str = None):
+        """记录一次与数据源健康无关的失败（请求本身有误），不计入熔断"""
+        self.permanent_fail_count += 1
+        if self.state == HALF_OPEN:
+            # 探测请求得到了明确的错误响应，说明数据源已恢复；关闭熔断并释放探测名额，
+            # 否则 _probing 一直为 True，数据源将永久不可用
+            self.record_success()
+        print(f"[ERROR] {self.__class__.__name__} 请求失败（不计入熔断）: {reason}")
 
     def is_available(self) -> bool:
-        """检查当前是否可用"""
-        return time.time() >= self.cooldown_until
+        """检查当前是否可用（不占用探测名额）"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() >= self.cooldown_until
+        return not self._probing
+
+    def allow_request(self) -> bool:
+        """请求发起前调用：CLOSED 直接放行，冷却结束后只放行一个探测请求"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self.cooldown_until:
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
 
     @abstractmethod
     def get_stock_list(self): pass
@@ -34,5 +200,12 @@ class StockDataSource(ABC):
     @abstractmethod
     def get_daily(self, code, start_date, end_date=None, adjust="qfq"): pass
 
+    def get_daily_batch(self, codes, start_date, end_date=None, adjust="qfq"):
+        """
+        批量获取日线，返回 {code: DataFrame}
+        默认逐只调用 get_daily，子类可覆盖为并发/批量实现
+        """
+        return {code: self.get_daily(code, start_date, end_date, adjust) for code in codes}
+
     @abstractmethod
-    def get_today(self, code): pass
\ No newline at end of file
+    def get_today(self, code): pass
@@ -0,0 +1,171 @@
+import sys
+import threading
+import time
+import types
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pandas as pd
+import requests
+
+# 测试环境不依赖 akshare：用桩模块代替，接口函数定义在桩模块内，__globals__ 中带有 requests
+ak_stub = types.ModuleType("akshare")
+exec(
+    "import requests\n"
+    "def stock_info_a_code_name():\n"
+    "    return None\n"
+    "def stock_zh_a_hist(**kwargs):\n"
+    "    return None\n"
+    "def stock_zh_a_spot_em():\n"
+    "    return None\n",
+    ak_stub.__dict__,
+)
+with patch.dict(sys.modules, {"akshare": ak_stub}):
+    from gupiao.ds import datasource_factory
+    from gupiao.ds.ak import AkShareDataSource as akshare_module
+    from gupiao.ds.datasource_factory import DataSourceFactory
+    from gupiao.ds.stock_data_source import InvalidRequestError
+
+
+class FakeSource:
+    """记录调用次数的测试数据源"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+        self.batch_calls = []
+        self._lock = threading.Lock()
+
+    def is_available(self):
+        return True
+
+    def get_stock_list(self):
+        with self._lock:
+            self.calls += 1
+        return pd.DataFrame({"code": ["600000", "000001"]})
+
+    def get_daily(self, code, start_date, end_date=None, adjust="qfq"):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return pd.DataFrame({"code": [code], "close": [10.0]})
+
+    def get_daily_batch(self, codes, start_date, end_date=None, adjust="qfq"):
+        self.batch_calls.append(list(codes))
+        return {code: self.get_daily(code, start_date, end_date, adjust) for code in codes}
+
+    def get_today(self, code):
+        return self.get_daily(code, "20250101")
+
+
+class TestDataSourceFactory(unittest.TestCase):
+
+    def setUp(self):
+        """测试前准备"""
+        self.source = FakeSource()
+        self.factory = DataSourceFactory()
+        self.factory.sources = [self.source]
+
+    def test_concurrent_identical_calls_fetch_once(self):
+        """测试并发的相同请求只触发一次拉取"""
+        self.source.delay = 0.2
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            dfs = list(ex.map(lambda _: self.factory.get_daily("600000", "20250103", "20250107"), range(8)))
+
+        self.assertEqual(self.source.calls, 1)
+        for df in dfs:
+            pd.testing.assert_frame_equal(df, dfs[0])
+
+    def test_memory_hit_returns_copy(self):
+        """测试内存缓存命中返回副本，调用方修改不影响缓存"""
+        first = self.factory.get_stock_list()
+        first["code"] = "changed"
+
+        second = self.factory.get_stock_list()
+        self.assertEqual(second["code"].tolist(), ["600000", "000001"])
+        self.assertEqual(self.source.calls, 1)
+
+    def test_ttl_expiry(self):
+        """测试内存缓存按 key 前缀的有效期过期"""
+        with patch.object(datasource_factory.time, "time", return_value=1000.0):
+            self.factory.get_daily("600000", "20250103", "20250107")
+            self.factory.get_daily("600000", "20250103", "20250107")
+        self.assertEqual(self.source.calls, 1)
+
+        expired = 1000.0 + DataSourceFactory.MEM_TTL_BY_PREFIX["daily_"]
+        with patch.object(datasource_factory.time, "time", return_value=expired):
+            self.factory.get_daily("600000", "20250103", "20250107")
+        self.assertEqual(self.source.calls, 2)
+
+    def test_lru_eviction(self):
+        """测试超过容量时淘汰最久未使用的条目"""
+        self.factory.MEM_MAXSIZE = 2
+        self.factory.get_daily("600000", "20250103")
+        self.factory.get_daily("000001", "20250103")
+        self.factory.get_daily("600000", "20250103")  # 600000 变为最近使用
+        self.factory.get_daily("000002", "20250103")  # 淘汰 000001
+        self.assertEqual(self.source.calls, 3)
+
+        self.factory.get_daily("600000", "20250103")
+        self.assertEqual(self.source.calls, 3)
+        self.factory.get_daily("000001", "20250103")
+        self.assertEqual(self.source.calls, 4)
+
+    def test_daily_batch_accepts_generator(self):
+        """测试批量接口接受生成器，且只把未命中缓存的代码交给数据源"""
+        self.factory.get_daily("600000", "20250103", "20250107")
+
+        result = self.factory.get_daily_batch((c for c in ["600000", "000001"]), "20250103", "20250107")
+
+        self.assertEqual(list(result), ["600000", "000001"])
+        self.assertEqual(result["000001"]["code"].tolist(), ["000001"])
+        self.assertEqual(self.source.batch_calls, [["000001"]])
+
+    def test_daily_batch_falls_through_sources(self):
+        """测试前一个数据源没拿到的代码交给下一个数据源"""
+        first = FakeSource()
+        first.get_daily = lambda code, *args: pd.DataFrame() if code == "000001" else \
+            pd.DataFrame({"code": [code], "close": [10.0]})
+        self.factory.sources = [first, self.source]
+
+        result = self.factory.get_daily_batch(["600000", "000001"], "20250103", "20250107")
+
+        self.assertEqual(self.source.batch_calls, [["000001"]])
+        self.assertFalse(result["000001"].empty)
+
+    def test_rejects_bad_dates(self):
+        """测试日期格式错误时不发起请求"""
+        with self.assertRaises(InvalidRequestError):
+            self.factory.get_daily("600000", "2025-01-03")
+        with self.assertRaises(InvalidRequestError):
+            self.factory.get_daily_batch(["600000"], "20250103", "2025-01-07")
+        self.assertEqual(self.source.calls, 0)
+
+
+class TestAkShareDataSource(unittest.TestCase):
+
+    def test_install_shared_session(self):
+        """测试 akshare 接口模块中的 requests 被替换为共享 Session"""
+        with patch.object(akshare_module, "_session_installed", False), \
+                patch.dict(ak_stub.__dict__, {"requests": requests}):
+            akshare_module.AkShareDataSource()
+            self.assertIsInstance(ak_stub.__dict__["requests"], akshare_module._SessionRequests)
+
+    def test_get_today_reuses_spot_table(self):
+        """测试 SPOT_TTL 内多次 get_today 复用同一份实时行情全表"""
+        spot = pd.DataFrame({"代码": ["600000", "000001"], "最新价": [10.0, 12.0]})
+        src = akshare_module.AkShareDataSource()
+        with patch.object(akshare_module.ak, "stock_zh_a_spot_em", return_value=spot) as mock_spot:
+            first = src.get_today("000001")
+            second = src.get_today("600000")
+            missing = src.get_today("999999")
+
+        mock_spot.assert_called_once()
+        self.assertEqual(first["最新价"].tolist(), [12.0])
+        self.assertEqual(second["最新价"].tolist(), [10.0])
+        self.assertTrue(missing.empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
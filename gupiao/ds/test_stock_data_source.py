@@ -0,0 +1,190 @@
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import requests
+
+from gupiao.ds.stock_data_source import (CLOSED, HALF_OPEN, OPEN, InvalidRequestError, StockDataSource,
+                                         circuit_guard, is_permanent, is_transient, retry_transient)
+
+
+class FlakySource(StockDataSource):
+    """可控制成功/失败的测试数据源"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.error = None
+        self.calls = 0
+
+    @circuit_guard
+    def get_stock_list(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return pd.DataFrame({"code": ["600000"]})
+
+    def get_daily(self, code, start_date, end_date=None, adjust="qfq"):
+        return pd.DataFrame()
+
+    def get_today(self, code):
+        return pd.DataFrame()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        """测试前准备"""
+        self.src = FlakySource(cooldown=10, max_fail=2, max_cooldown=30)
+        self.src.error = ConnectionError("网络错误")
+
+    def test_opens_after_max_fail(self):
+        """测试连续失败达到阈值后熔断，且熔断期间不再发起请求"""
+        self.src.get_stock_list()
+        self.assertEqual(self.src.state, CLOSED)
+        self.src.get_stock_list()
+        self.assertEqual(self.src.state, OPEN)
+        self.assertFalse(self.src.is_available())
+
+        self.assertTrue(self.src.get_stock_list().empty)
+        self.assertEqual(self.src.calls, 2)
+
+    def test_stale_failures_expire(self):
+        """测试统计窗口外的旧失败不再计入熔断"""
+        with patch('gupiao.ds.stock_data_source.time.monotonic', side_effect=[0.0, 100.0]):
+            self.src.get_stock_list()
+            self.src.get_stock_list()
+
+        self.assertEqual(self.src.state, CLOSED)
+        self.assertEqual(self.src.fail_count, 1)
+
+    def test_permanent_errors_do_not_trip(self):
+        """测试参数类错误不计入熔断，且原样抛给调用方"""
+        self.src.error = InvalidRequestError("bad date")
+        for _ in range(3):
+            with self.assertRaises(InvalidRequestError):
+                self.src.get_stock_list()
+
+        self.assertEqual(self.src.state, CLOSED)
+        self.assertEqual(self.src.fail_count, 0)
+        self.assertEqual(self.src.permanent_fail_count, 3)
+
+    def test_parse_errors_trip(self):
+        """测试解析类错误（限流或残缺数据）计入熔断"""
+        self.src.error = KeyError("data")
+        self.assertTrue(self.src.get_stock_list().empty)
+        self.assertTrue(self.src.get_stock_list().empty)
+
+        self.assertEqual(self.src.state, OPEN)
+        self.assertEqual(self.src.permanent_fail_count, 0)
+
+    def test_half_open_single_probe(self):
+        """测试冷却结束后只放行一个探测请求"""
+        self.src.get_stock_list()
+        self.src.get_stock_list()
+        self.src.cooldown_until = time.monotonic() - 1
+
+        self.assertTrue(self.src.is_available())
+        self.assertTrue(self.src.allow_request())
+        self.assertEqual(self.src.state, HALF_OPEN)
+        self.assertFalse(self.src.allow_request())
+
+    def test_probe_failure_doubles_cooldown(self):
+        """测试探测失败后冷却时间指数增长"""
+        self.src.get_stock_list()
+        self.src.get_stock_list()
+        self.src.cooldown_until = time.monotonic() - 1
+
+        self.src.get_stock_list()
+        self.assertEqual(self.src.state, OPEN)
+        self.assertGreater(self.src.cooldown_until - time.monotonic(), 15)
+
+    def test_probe_success_closes(self):
+        """测试探测成功后恢复正常"""
+        self.src.get_stock_list()
+        self.src.get_stock_list()
+        self.src.cooldown_until = time.monotonic() - 1
+        self.src.error = None
+
+        self.assertFalse(self.src.get_stock_list().empty)
+        self.assertEqual(self.src.state, CLOSED)
+        self.assertEqual(self.src.fail_count, 0)
+
+    def test_probe_permanent_error_releases_probe(self):
+        """测试探测请求遇到参数类错误时关闭熔断，不会一直占用探测名额"""
+        self.src.get_stock_list()
+        self.src.get_stock_list()
+        self.src.cooldown_until = time.monotonic() - 1
+        self.src.error = InvalidRequestError("bad date")
+
+        with self.assertRaises(InvalidRequestError):
+            self.src.get_stock_list()
+        self.assertEqual(self.src.state, CLOSED)
+        self.assertTrue(self.src.is_available())
+
+        self.src.error = None
+        self.assertFalse(self.src.get_stock_list().empty)
+
+
+class TestRetryTransient(unittest.TestCase):
+
+    def setUp(self):
+        """测试前准备"""
+        self.src = FlakySource()
+
+    @staticmethod
+    def _http_error(status):
+        response = MagicMock()
+        response.status_code = status
+        return requests.HTTPError(response=response)
+
+    def test_is_transient(self):
+        """测试临时性错误分类"""
+        self.assertTrue(is_transient(self._http_error(429)))
+        self.assertTrue(is_transient(self._http_error(503)))
+        self.assertTrue(is_transient(requests.ConnectionError()))
+        self.assertTrue(is_transient(KeyError("data")))
+        self.assertFalse(is_transient(self._http_error(404)))
+        self.assertFalse(is_transient(InvalidRequestError("bad date")))
+
+    def test_is_permanent(self):
+        """测试永久性错误分类"""
+        self.assertTrue(is_permanent(self._http_error(404)))
+        self.assertTrue(is_permanent(InvalidRequestError("bad date")))
+        self.assertFalse(is_permanent(ValueError("garbled payload")))
+        self.assertFalse(is_permanent(self._http_error(429)))
+        self.assertFalse(is_permanent(self._http_error(502)))
+        self.assertFalse(is_permanent(requests.Timeout()))
+
+    @patch('gupiao.ds.stock_data_source.time.sleep')
+    def test_retries_transient_until_success(self, mock_sleep):
+        """测试临时性错误重试后成功"""
+        func = MagicMock(side_effect=[self._http_error(429), self._http_error(503), "ok"])
+        result = retry_transient(lambda self: func())(self.src)
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch('gupiao.ds.stock_data_source.time.sleep')
+    def test_no_retry_on_permanent_error(self, mock_sleep):
+        """测试非临时性错误不重试"""
+        func = MagicMock(side_effect=InvalidRequestError("bad date"))
+        with self.assertRaises(InvalidRequestError):
+            retry_transient(lambda self: func())(self.src)
+
+        func.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch('gupiao.ds.stock_data_source.time.sleep')
+    def test_gives_up_after_attempts(self, mock_sleep):
+        """测试达到最大尝试次数后抛出最后一次异常"""
+        func = MagicMock(side_effect=requests.ConnectionError())
+        with self.assertRaises(requests.ConnectionError):
+            retry_transient(lambda self: func())(self.src)
+
+        self.assertEqual(func.call_count, StockDataSource.RETRY_ATTEMPTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
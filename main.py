@@ -1,6 +1,12 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
 import akshare as ak
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from tqdm import tqdm
 import requests
 
@@ -12,6 +18,15 @@ TURNOVER_MAX = 5.0            # 换手率上限（%）
 DAILY_RISE_MIN = 1.0          # 每日涨幅下限（%）
 MIN_LISTED_DAYS = 60          # 次新过滤
 EXCLUDE_ST = True
+MAX_WORKERS = 16              # 并发拉取行情的线程数（网络IO为主）
+CACHE_DIR = Path("cache/hist")  # 日线行情的Parquet缓存目录
+# akshare 日线的中文列名 -> 统一列名
+HIST_COLUMNS = {
+    "日期":"date","开盘":"open","收盘":"close","最高":"high","最低":"low","涨跌幅":"pct_chg",
+    "换手率":"turnover","成交量":"vol","成交额":"amount"
+}
+# 价格、涨跌幅、换手率只需 7 位有效数字，统一存成 float32
+FLOAT32_COLUMNS = ("open", "close", "high", "low", "pct_chg", "turnover")
 ak.session = requests.Session()
 ak.session.headers.update({
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -20,6 +35,11 @@ ak.session.headers.update({
 })
 
 # --------------- 工具函数 ---------------
+def to_float32(df):
+    """ FLOAT32_COLUMNS 中存在的列转成 float32，中文原始列名与统一列名均可 """
+    names = FLOAT32_COLUMNS + tuple(k for k, v in HIST_COLUMNS.items() if v in FLOAT32_COLUMNS)
+    return df.astype({c: "float32" for c in names if c in df.columns})
+
 def get_a_stock_list():
     df = ak.stock_info_a_code_name()  # 沪深 A 股
     # 过滤 ST、退市、北交所（B 股与北交所可按需过滤）
@@ -60,7 +80,7 @@ def fetch_stock_hist(code, start_date="20100101", end_date=None, adjust="qfq"):
 
             if df is not None and not df.empty:
                 print(f"[INFO] 成功获取数据源: {name}, 股票: {code}")
-                return df
+                return to_float32(df)
         except Exception as e:
             print(f"[WARN] 数据源 {name} 失败: {e}")
             last_err = e
@@ -69,112 +89,187 @@ def fetch_stock_hist(code, start_date="20100101", end_date=None, adjust="qfq"):
     print(f"[ERROR] 所有数据源都失败: {code}, error={last_err}")
     return pd.DataFrame()
 
+def fetch_stock_hist_cached(code, start_date="20100101", adjust="qfq"):
+    """
+    带Parquet磁盘缓存的日线拉取，当天写入的缓存直接使用
+    不复权/后复权的历史价格不会变化，缓存过期后只增量拉取最后缓存日期之后的数据；
+    前复权价格在每次除权后整体变化，缓存过期后整段重新拉取
+    """
+    path = CACHE_DIR / f"{code}_{adjust or 'raw'}_{start_date}.parquet"
+    cached = None
+    if path.exists():
+        try:
+            cached = pd.read_parquet(path)
+        except Exception as e:
+            # 缓存文件损坏（如写入中途被中断）按未命中处理：删除后重新拉取
+            print(f"[WARN] 缓存文件损坏，重新拉取: {path}, error={e}")
+            path.unlink(missing_ok=True)
+        else:
+            if pd.Timestamp.fromtimestamp(path.stat().st_mtime).date() == pd.Timestamp.today().date():
+                return cached
+
+    # 可增量追加时，从最后缓存日期的下一天开始拉取
+    base = cached if adjust != "qfq" and cached is not None and not cached.empty else None
+    fetch_start = start_date
+    if base is not None:
+        fetch_start = (pd.to_datetime(base["日期"]).max() + pd.Timedelta(days=1)).strftime("%Y%m%d")
+    df = fetch_stock_hist(code, start_date=fetch_start, adjust=adjust)
+    if df.empty:
+        # 没有新数据或拉取失败时沿用已有缓存
+        return cached if cached is not None else df
+    if base is not None:
+        df = pd.concat([base, df], ignore_index=True).drop_duplicates("日期", keep="last")
+
+    # 先写同目录下的临时文件再原子替换，中断或并发读取都不会看到写了一半的缓存
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        df.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return df
+
 def fetch_hist_k(code):
     # 复权价：前复权；包含换手率
     df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=START_DATE.replace("-",""),
                             end_date=None if END_DATE is None else END_DATE.replace("-",""),
                             adjust="qfq")
-    if df is None or df.empty:
+    # 行数不足 MIN_LISTED_DAYS + 3 的股票不会产生信号，跳过后续清洗
+    if df is None or len(df) < MIN_LISTED_DAYS + 3:
         return pd.DataFrame()
     # 统一列名
-    df = df.rename(columns={
-        "日期":"date","开盘":"open","收盘":"close","最高":"high","最低":"low","涨跌幅":"pct_chg",
-        "换手率":"turnover","成交量":"vol","成交额":"amount"
-    })
+    df = df.rename(columns=HIST_COLUMNS)
     # 数据清洗
     df["date"] = pd.to_datetime(df["date"])
-    # ak 的“涨跌幅”为百分比（带 % 符号的字符串或已转为数值），统一成 float
-    if df["pct_chg"].dtype == "O":
-        df["pct_chg"] = df["pct_chg"].str.replace("%","").astype(float)
-    else:
-        df["pct_chg"] = df["pct_chg"].astype(float)
-    if df["turnover"].dtype == "O":
-        df["turnover"] = df["turnover"].str.replace("%","").replace("", np.nan).astype(float)
-    else:
-        df["turnover"] = df["turnover"].astype(float)
+    # ak 的“涨跌幅”“换手率”为百分比（带 % 符号的字符串或已转为数值），统一成 float；空串等无法解析的值记为 NaN
+    for c in ("pct_chg", "turnover"):
+        if df[c].dtype == "O":
+            df[c] = pd.to_numeric(df[c].str.rstrip("%"), errors="coerce")
+        else:
+            df[c] = df[c].astype(float)
     df = df.sort_values("date").reset_index(drop=True)
-    return df
+    return to_float32(df)
+
+def stock_positions(stock):
+    """
+    stock 为逐行的股票编号，同一股票的行连续排列；
+    返回每行在所属股票内的序号（0 起）和所属股票的行数
+    """
+    starts = np.flatnonzero(np.r_[True, stock[1:] != stock[:-1]])
+    lengths = np.diff(np.r_[starts, len(stock)])
+    pos = np.arange(len(stock)) - np.repeat(starts, lengths)
+    return pos, np.repeat(lengths, lengths)
 
 def mark_signal(df):
-    """ 标记严格条件：连续3天，日涨幅>1%，换手<5% """
-    if df.empty or len(df) < MIN_LISTED_DAYS + 3:
-        df["signal"] = False
-        return df
-    # 上市满 MIN_LISTED_DAYS
-    df["listed_days"] = np.arange(1, len(df)+1)
-    cond_len = df["listed_days"] >= MIN_LISTED_DAYS
-
-    r = df["pct_chg"] > DAILY_RISE_MIN
-    t = df["turnover"] < TURNOVER_MAX
-
-    # 连续 3 天条件（逐日均满足）
-    c3 = r & t
-    sig = c3 & c3.shift(1) & c3.shift(2)
-    sig = sig.fillna(False)
-
-    df["signal"] = sig & cond_len
+    """
+    标记严格条件：连续3天，日涨幅>1%，换手<5%
+    df 为多只股票按 stock 编号拼接的行情，每只股票内部按日期升序
+    """
+    pos, size = stock_positions(df["stock"].to_numpy())
+    df["listed_days"] = pos + 1
+
+    r = df["pct_chg"].to_numpy() > DAILY_RISE_MIN
+    t = df["turnover"].to_numpy() < TURNOVER_MAX
+
+    # 连续 3 天条件（逐日均满足）：长度为 3 的滑动窗口内全部满足
+    c3 = (r & t).astype(np.uint8)
+    sig = np.zeros(len(df), dtype=bool)
+    if len(df) >= 3:
+        sig[2:] = sliding_window_view(c3, 3).sum(axis=1) == 3
+    # 窗口在全表上滑动，要求股票内序号 >= 2，保证窗口不跨越两只股票
+    sig &= pos >= 2
+
+    # 上市满 MIN_LISTED_DAYS；数据不足 MIN_LISTED_DAYS + 3 行的股票不产生信号
+    df["signal"] = sig & (pos + 1 >= MIN_LISTED_DAYS) & (size >= MIN_LISTED_DAYS + 3)
     return df
 
-def compute_forward_stats(df, hold_days):
+def compute_forward_stats(df, hold_days, n_stocks):
     """
     对标记为 signal 的日子 t，计算 t+N 收益：
     forward_ret_N = close[t+N]/close[t] - 1
+    close 为 float32，收益在 float32 下计算，相对收益的精度足够；
+    全表一次取出所有信号日，t+N 超出所属股票数据末尾的不计入。
+    返回 n / win_rate / mean / median 四个数组，形状为 (持有期数, n_stocks)，
+    按 (持有期序号, 股票编号) 索引，没有样本的位置 n 为 0、其余为 nan
     """
-    if df.empty or not df["signal"].any():
-        return {N: {"n":0,"win_rate":np.nan,"mean":np.nan,"median":np.nan} for N in hold_days}
+    stock = df["stock"].to_numpy()
+    pos, size = stock_positions(stock)
+    closes = df["close"].to_numpy()
 
-    out = {}
-    closes = df["close"].values
-    sig_idx = np.where(df["signal"].values)[0]
+    shape = (len(hold_days), n_stocks)
+    n_arr = np.zeros(shape, dtype=np.int32)
+    win_arr = np.full(shape, np.nan, dtype=np.float32)
+    mean_arr = np.full(shape, np.nan, dtype=np.float32)
+    median_arr = np.full(shape, np.nan, dtype=np.float32)
 
-    for N in hold_days:
-        valid = sig_idx[sig_idx + N < len(df)]
-        if len(valid) == 0:
-            out[N] = {"n":0,"win_rate":np.nan,"mean":np.nan,"median":np.nan}
-            continue
-        rets = closes[valid + N] / closes[valid] - 1.0
-        out[N] = {
-            "n": int(len(rets)),
-            "win_rate": float((rets > 0).mean()),
-            "mean": float(np.mean(rets)),
-            "median": float(np.median(rets)),
-        }
-    return out
+    sig_idx = np.flatnonzero(df["signal"].to_numpy())
+    remaining = size[sig_idx] - pos[sig_idx] - 1    # 信号日之后该股票还有几行
 
-# --------------- 主流程 ---------------
-all_stats = {N: [] for N in HOLD_DAYS}
-signals_per_stock = []
+    for j, N in enumerate(hold_days):
+        idx = sig_idx[remaining >= N]
+        s = stock[idx]
+        rets = closes[idx + N] / closes[idx] - np.float32(1)
 
-stock_list = get_a_stock_list()
-for _, row in tqdm(stock_list.iterrows(), total=len(stock_list)):
-    code, name = row["code"], row["name"]
+        n = np.bincount(s, minlength=n_stocks)
+        has = n > 0
+        n_arr[j] = n
+        win_arr[j, has] = np.bincount(s, weights=rets > 0, minlength=n_stocks)[has] / n[has]
+        mean_arr[j, has] = np.bincount(s, weights=rets, minlength=n_stocks)[has] / n[has]
+
+        # 中位数：按 (股票, 收益) 排序后，取每只股票中间的一个或两个样本
+        sorted_rets = rets[np.lexsort((rets, s))]
+        start = np.cumsum(n) - n
+        lo = start + (n - 1) // 2
+        hi = start + n // 2
+        median_arr[j, has] = (sorted_rets[lo[has]] + sorted_rets[hi[has]]) / 2
+    return n_arr, win_arr, mean_arr, median_arr
+
+def load_stock(code):
+    """ 拉取单只股票行情，只保留信号统计用到的列，无数据或数据过短时返回 None """
     # df = fetch_hist_k(code)
-    df = fetch_stock_hist(code)
-    if df.empty:
-        continue
-    df = mark_signal(df)
-    # 记录每只股票的信号数
-    sig_count = int(df["signal"].sum())
-    if sig_count > 0:
-        signals_per_stock.append({"code":code,"name":name,"signals":sig_count})
-    # 聚合每只股票的 forward 统计
-    stats = compute_forward_stats(df, HOLD_DAYS)
-    for N in HOLD_DAYS:
-        if stats[N]["n"] > 0:
-            all_stats[N].append(stats[N])
+    df = fetch_stock_hist_cached(code)
+    # 行数不足 MIN_LISTED_DAYS + 3 的股票不会产生信号，不必改名、转换类型和拼接
+    if len(df) < MIN_LISTED_DAYS + 3:
+        return None
+    # 旧缓存可能仍是 float64
+    df = to_float32(df.rename(columns=HIST_COLUMNS))
+    return df[["close", "pct_chg", "turnover"]]
+
+# --------------- 主流程 ---------------
+stock_list = get_a_stock_list()
+frames, stocks = [], []
+# 行情拉取是网络IO，多线程并发；结果只在主线程汇总，无需加锁
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+    futures = {ex.submit(load_stock, code): i for i, code in enumerate(stock_list["code"])}
+    for future in tqdm(as_completed(futures), total=len(futures)):
+        df = future.result()
+        if df is not None:
+            frames.append(df)
+            stocks.append(futures[future])
+
+# 全部股票拼成一张长表，stock 列为股票在 stock_list 中的序号，信号与 forward 收益在整表上一次算出
+if frames:
+    big = pd.concat(frames, keys=stocks, names=["stock"]).reset_index(0).reset_index(drop=True)
+else:
+    big = pd.DataFrame({"stock": np.zeros(0, dtype=np.int64), "close": [], "pct_chg": [], "turnover": []})
+big = mark_signal(big)
+n_arr, win_arr, mean_arr, median_arr = compute_forward_stats(big, HOLD_DAYS, len(stock_list))
 
 # 汇总全市场
 summary = []
-for N in HOLD_DAYS:
-    if len(all_stats[N]) == 0:
+for j, N in enumerate(HOLD_DAYS):
+    has = n_arr[j] > 0
+    if not has.any():
         summary.append({"horizon":N,"signals":0,"win_rate":None,"mean":None,"median":None})
         continue
-    dfN = pd.DataFrame(all_stats[N])
-    total_signals = int(dfN["n"].sum())
+    n = n_arr[j, has]
+    total_signals = int(n.sum())
     # 以“每个样本”为权重做加权平均
-    win_rate = float((dfN["win_rate"] * dfN["n"]).sum() / total_signals)
-    mean_ret = float((dfN["mean"] * dfN["n"]).sum() / total_signals)
-    median_ret = float(dfN["median"].median())  # 中位数简单取中位
+    win_rate = float((win_arr[j, has] * n).sum() / total_signals)
+    mean_ret = float((mean_arr[j, has] * n).sum() / total_signals)
+    median_ret = float(np.median(median_arr[j, has]))  # 中位数简单取中位
     summary.append({
         "horizon": N,
         "signals": total_signals,
@@ -183,10 +278,20 @@ for N in HOLD_DAYS:
         "median": median_ret
     })
 
+# 每只股票的信号数
+sig_counts = np.bincount(big["stock"].to_numpy(), weights=big["signal"].to_numpy(),
+                         minlength=len(stock_list)).astype(int)
+top = np.flatnonzero(sig_counts)
+top = top[np.argsort(-sig_counts[top], kind="stable")]
+
 summary_df = pd.DataFrame(summary)
-signals_df = pd.DataFrame(signals_per_stock).sort_values("signals", ascending=False)
+signals_df = pd.DataFrame({
+    "code": stock_list["code"].to_numpy()[top],
+    "name": stock_list["name"].to_numpy()[top],
+    "signals": sig_counts[top],
+})
 
 print("=== 条件：连续3天 每日涨幅>1% & 每日换手<5% ===")
 print(summary_df.to_string(index=False))
 print("\n每只股票的信号出现次数（Top 20）：")
-print(signals_df.head(20).to_string(index=False))
\ No newline at end of file
+print(signals_df.head(20).to_string(index=False))